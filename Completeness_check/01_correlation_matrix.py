@@ -1,29 +1,24 @@
-import pandas as pd
+import argparse
 
-# === 1. Datei laden ===
-file_path = "../cvs/Beispielobjekte.xlsx"   # Pfad zur Datei anpassen!
-sheet_name = "Anlagen"
+from _shared import build_reference_matrix
 
-# Daten einlesen
-data = pd.read_excel(file_path, sheet_name=sheet_name, header=0, engine="openpyxl")
+parser = argparse.ArgumentParser(description="Korrelationsmatrix der Referenzdaten erstellen")
+parser.add_argument("--xlsx", action="store_true", help="Ergebnis zusätzlich als Excel-Datei speichern")
+args = parser.parse_args()
 
-# === 2. Daten vorbereiten ===
-# Pivot-Tabelle: Gebäude-ID vs. Installationen (One-Hot-Encoding)
-building_installations = (
-    data.groupby(["Gebäude-ID", "AKS-Bezeichnung"])
-    .size()
-    .unstack(fill_value=0)           # jede Installation eigene Spalte
-)
+# === 1. Referenzdaten aufbauen ===
+# Lädt ../cvs/Beispielobjekte.xlsx (Sheet "Anlagen") und berechnet die Gebäude-Installation
+# Matrix sowie die Korrelationsmatrix (gemeinsam mit Schritt 2 und 3 genutzt)
+building_installations, frequency_analysis, correlation_matrix, verbandsnummer_mapping = build_reference_matrix()
 
-# Alles in 1/0 umwandeln (vorhanden = 1, sonst 0)
-building_installations = (building_installations > 0).astype(int)
+# === 2. Ergebnisse speichern ===
+# Parquet ist deutlich schneller als Excel; Excel nur auf Wunsch zur manuellen Ansicht
+output_path_matrix = "01_correlation_matrix.parquet"
+correlation_matrix.to_parquet(output_path_matrix)
 
-# === 3. Korrelationsmatrix berechnen ===
-correlation_matrix = building_installations.corr()
-
-# === 4. Ergebnisse speichern ===
-output_path_matrix = "01_correlation_matrix.xlsx"
-correlation_matrix.to_excel(output_path_matrix)
+if args.xlsx:
+    correlation_matrix.to_excel("01_correlation_matrix.xlsx", engine="xlsxwriter")
+    print("Excel-Export gespeichert unter: 01_correlation_matrix.xlsx")
 
 print(f"Korrelationsmatrix gespeichert unter: {output_path_matrix}")
 print(f"Matrix-Größe: {correlation_matrix.shape}")
@@ -3,22 +3,69 @@ import numpy as np
 import logging
 import json
 import os
+import hashlib
 from typing import Dict, List, Tuple
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 import torch
+from numba import njit, prange
+
+from _shared import load_reference
 
 # Logging konfigurieren
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Skalierung für int8-quantisierte (normierte) Embeddings
+EMBEDDING_SCALE = 127
+
+@njit(parallel=True, cache=True)
+def _best_correlations(existing_mask, correlation_values, correlation_mask):
+    """
+    Bestimmt je Gebäude für jede fehlende Installation die stärkste Korrelation mit einer
+    vorhandenen Installation (parallel über Gebäude).
+    
+    Args:
+        existing_mask: Vorhandene Installationen (Gebäude x Installationen, bool)
+        correlation_values: Korrelationsmatrix (Installationen x Installationen, float32)
+        correlation_mask: Korrelationen über dem Schwellenwert, ohne Diagonale (bool)
+        
+    Returns:
+        Tuple (best_correlation, best_correlated_with) - -inf bzw. 0 wenn keine Korrelation vorliegt
+    """
+    n_buildings, n_installations = existing_mask.shape
+    best_correlation = np.full((n_buildings, n_installations), -np.inf, dtype=np.float32)
+    best_correlated_with = np.zeros((n_buildings, n_installations), dtype=np.int64)
+    
+    for b in prange(n_buildings):
+        for source in range(n_installations):
+            if not existing_mask[b, source]:
+                continue
+            for target in range(n_installations):
+                if (correlation_mask[source, target] and not existing_mask[b, target]
+                        and correlation_values[source, target] > best_correlation[b, target]):
+                    best_correlation[b, target] = correlation_values[source, target]
+                    best_correlated_with[b, target] = source
+    
+    return best_correlation, best_correlated_with
+
 class FinalCompletenessChecker:
-    def __init__(self, model_name: str = 'T-Systems-onsite/cross-en-de-roberta-sentence-transformer'):
+    def __init__(self, model_name: str = 'T-Systems-onsite/cross-en-de-roberta-sentence-transformer',
+                 embedding_cache_dir: str = "embedding_cache"):
         """
         Initialisiert den Final Completeness Checker.
+        
+        Args:
+            model_name: Name des zu verwendenden Sentence Transformer Modells
+            embedding_cache_dir: Verzeichnis für zwischengespeicherte Referenz-Embeddings
         """
+        self.model_name = model_name
         self.model = SentenceTransformer(model_name)
+        self.embedding_cache_dir = embedding_cache_dir
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        
+        # Auf der GPU in fp16 rechnen (Tensor Cores, halber Speicher für Aktivierungen)
+        if self.device == 'cuda':
+            self.model = self.model.half()
         self.frequency_analysis = None
         self.correlation_matrix = None
         self.building_installations_reference = None
@@ -29,74 +76,75 @@ class FinalCompletenessChecker:
         
     def load_reference_data(self):
         """
-        Lädt die Referenzdaten (Frequenzanalyse und Korrelationsmatrix).
+        Lädt die Referenzdaten (Frequenzanalyse, Korrelationsmatrix, Referenzmatrix und Verbandsnummer-Mapping).
         """
         logger.info("Lade Referenzdaten...")
         
-        # Lade Frequenzanalyse
-        if os.path.exists("02_frequency_analysis.xlsx"):
-            self.frequency_analysis = pd.read_excel("02_frequency_analysis.xlsx")
-            logger.info(f"Frequenzanalyse geladen: {len(self.frequency_analysis)} Installationen")
-        else:
-            logger.error("Frequenzanalyse nicht gefunden! Führe zuerst 02_frequency_analysis.py aus.")
-            return False
-        
-        # Lade Korrelationsmatrix
-        if os.path.exists("01_correlation_matrix.xlsx"):
-            self.correlation_matrix = pd.read_excel("01_correlation_matrix.xlsx", index_col=0)
-            logger.info(f"Korrelationsmatrix geladen: {self.correlation_matrix.shape}")
-        else:
-            logger.error("Korrelationsmatrix nicht gefunden! Führe zuerst 01_correlation_matrix.py aus.")
+        try:
+            (self.building_installations_reference, self.frequency_analysis,
+             self.correlation_matrix, self.verbandsnummer_mapping) = load_reference()
+        except FileNotFoundError as e:
+            logger.error(f"Referenzdaten nicht gefunden: {e}")
             return False
         
-        # Erstelle Gebäude-Installation Referenzmatrix
-        self._create_reference_matrix()
+        logger.info(f"Frequenzanalyse geladen: {len(self.frequency_analysis)} Installationen")
+        logger.info(f"Korrelationsmatrix geladen: {self.correlation_matrix.shape}")
+        logger.info(f"Referenzmatrix geladen: {self.building_installations_reference.shape}")
+        logger.info(f"Verbandsnummer-Mapping geladen: {len(self.verbandsnummer_mapping)} Einträge")
         
         return True
     
-    def _create_reference_matrix(self):
+    def _encode(self, texts: List[str]) -> np.ndarray:
         """
-        Erstellt die Referenzmatrix für Gebäude-Installationen.
+        Berechnet normierte Embeddings für eine Liste von Texten (immer als float32).
         """
-        logger.info("Erstelle Referenzmatrix...")
-        
-        # Lade Originaldaten
-        data = pd.read_excel("../cvs/Beispielobjekte.xlsx", sheet_name="Anlagen")
-        
-        # Erstelle Gebäude-Installation Matrix
-        self.building_installations_reference = (
-            data.groupby(["Gebäude-ID", "AKS-Bezeichnung"])
-            .size()
-            .unstack(fill_value=0)
+        embeddings = self.model.encode(
+            texts,
+            batch_size=256,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=True,
+            device=self.device
         )
-        
-        # Konvertiere zu 1/0 Matrix
-        self.building_installations_reference = (self.building_installations_reference > 0).astype(int)
-        
-        # Erstelle Verbandsnummer-Mapping für Installationen
-        self._create_verbandsnummer_mapping(data)
-        
-        logger.info(f"Referenzmatrix erstellt: {self.building_installations_reference.shape}")
+        return np.asarray(embeddings, dtype=np.float32)
     
-    def _create_verbandsnummer_mapping(self, data: pd.DataFrame):
+    @staticmethod
+    def _quantize(embeddings: np.ndarray) -> np.ndarray:
+        """
+        Quantisiert normierte Embeddings (Werte in [-1, 1]) auf int8.
         """
-        Erstellt ein Mapping zwischen AKS-Bezeichnung und Verbandsnummer.
+        return np.round(np.asarray(embeddings, dtype=np.float32) * EMBEDDING_SCALE).astype(np.int8)
+    
+    def _get_or_compute_ref_embeddings(self, reference_installations: List[str]) -> np.ndarray:
         """
-        logger.info("Erstelle Verbandsnummer-Mapping...")
+        Lädt die int8-quantisierten Embeddings der Referenz-Installationen aus dem Cache oder berechnet sie.
         
-        # Erstelle Mapping: AKS-Bezeichnung -> Verbandsnummer
-        verbandsnummer_mapping = {}
+        Der Cache-Schlüssel setzt sich aus Modellname und Referenz-Installationen zusammen,
+        sodass geänderte Referenzdaten automatisch neu berechnet werden.
         
-        for _, row in data.iterrows():
-            aks_bezeichnung = row['AKS-Bezeichnung']
-            verbandsnummer = row.get('Verbandsnummer', '')
+        Args:
+            reference_installations: Liste der Referenz-Installationen
             
-            if pd.notna(verbandsnummer) and verbandsnummer != '':
-                verbandsnummer_mapping[aks_bezeichnung] = verbandsnummer
+        Returns:
+            Normierte, int8-quantisierte Embeddings der Referenz-Installationen
+        """
+        key = hashlib.sha1(
+            (self.model_name + "|" + "|".join(map(str, reference_installations))).encode('utf-8')
+        ).hexdigest()
+        cache_path = os.path.join(self.embedding_cache_dir, f"{key}_int8.npy")
         
-        self.verbandsnummer_mapping = verbandsnummer_mapping
+        if os.path.exists(cache_path):
+            logger.info(f"Lade Referenz-Embeddings aus Cache: {cache_path}")
+            return np.load(cache_path, mmap_mode='r')
+        
+        logger.info("Berechne Embeddings für Referenz-Installationen...")
+        reference_embeddings = self._quantize(self._encode(reference_installations))
         
-        logger.info(f"Verbandsnummer-Mapping erstellt: {len(self.verbandsnummer_mapping)} Einträge")
+        os.makedirs(self.embedding_cache_dir, exist_ok=True)
+        np.save(cache_path, reference_embeddings)
+        logger.info(f"Referenz-Embeddings gespeichert: {cache_path}")
+        
+        return reference_embeddings
     
     def create_installation_mapping(self, kunde_installations: List[str], similarity_threshold: float = 0.7):
         """
@@ -111,16 +159,18 @@ class FinalCompletenessChecker:
         # Referenz-Installationen
         reference_installations = self.frequency_analysis['Installation'].tolist()
         
-        # Berechne Embeddings
-        logger.info("Berechne Embeddings für Kundendatei-Installationen...")
-        kunde_embeddings = self.model.encode(kunde_installations, show_progress_bar=True, device=self.device)
+        # Berechne Embeddings (Referenz-Embeddings werden zwischengespeichert)
+        reference_embeddings = self._get_or_compute_ref_embeddings(reference_installations)
         
-        logger.info("Berechne Embeddings für Referenz-Installationen...")
-        reference_embeddings = self.model.encode(reference_installations, show_progress_bar=True, device=self.device)
+        logger.info("Berechne Embeddings für Kundendatei-Installationen...")
+        kunde_embeddings = self._quantize(self._encode(kunde_installations))
         
-        # Berechne Ähnlichkeiten
+        # Berechne Ähnlichkeiten (Embeddings sind normiert -> Skalarprodukt = Cosinus-Ähnlichkeit)
+        # int32-Akkumulation, da int8/int16 bei 768 Dimensionen überlaufen würde
         logger.info("Berechne Ähnlichkeitsmatrix...")
-        similarity_matrix = cosine_similarity(kunde_embeddings, reference_embeddings)
+        similarity_matrix = (
+            kunde_embeddings.astype(np.int32) @ reference_embeddings.astype(np.int32).T
+        ).astype(np.float32) / (EMBEDDING_SCALE * EMBEDDING_SCALE)
         
         # Erstelle Mapping
         self.installation_mapping = {}
@@ -162,8 +212,17 @@ class FinalCompletenessChecker:
         """
         logger.info(f"Lade Kundendatei: {kundendatei_path}")
         
-        # Lade Kundendatei
-        kunde_data = pd.read_excel(kundendatei_path)
+        # Lade Kundendatei (nur benötigte Spalten; ohne Textspalten wird für den Fallback alles geladen)
+        text_columns = ["EQ-Klasse-Bezeichnung", "Anlagenausprägung"]
+        try:
+            kunde_data = pd.read_excel(
+                kundendatei_path,
+                engine="calamine",
+                usecols=["WirtEinh"] + text_columns,
+                dtype={col: "string" for col in text_columns}
+            )
+        except ValueError:
+            kunde_data = pd.read_excel(kundendatei_path, engine="calamine")
         logger.info(f"Kundendatei geladen: {len(kunde_data)} Zeilen")
         
         # Prüfe ob WirtEinh Spalte existiert
@@ -178,9 +237,15 @@ class FinalCompletenessChecker:
                 kunde_data['Anlagenausprägung'].fillna('').astype(str)
             )
         else:
-            # Fallback: Verwende alle Textspalten
+            # Fallback: Verwende alle Textspalten (vektorisiert über Arrow-Strings)
             text_columns = kunde_data.select_dtypes(include=['object']).columns
-            kunde_data['combined_installation'] = kunde_data[text_columns].fillna('').astype(str).agg(' '.join, axis=1)
+            if len(text_columns) == 0:
+                kunde_data['combined_installation'] = ''
+            else:
+                text_data = kunde_data[text_columns].astype("string[pyarrow]")
+                kunde_data['combined_installation'] = text_data[text_columns[0]].str.cat(
+                    [text_data[col] for col in text_columns[1:]], sep=' ', na_rep=''
+                )
         
         # Erstelle Gebäude-Installation Matrix
         kunde_building_installations = (
@@ -203,7 +268,8 @@ class FinalCompletenessChecker:
     
     def find_missing_installations(self, kunde_building_installations: pd.DataFrame, 
                                  frequency_threshold: float = 50.0,
-                                 correlation_threshold: float = 0.7) -> Dict:
+                                 correlation_threshold: float = 0.7,
+                                 max_correlated_suggestions: int = 10) -> Dict:
         """
         Findet fehlende Installationen basierend auf Frequenzanalyse und Korrelation.
         
@@ -211,6 +277,7 @@ class FinalCompletenessChecker:
             kunde_building_installations: Gebäude-Installation Matrix der Kundendatei
             frequency_threshold: Mindesthäufigkeit für "typische" Installationen (%)
             correlation_threshold: Mindestkorrelation für Vorschläge
+            max_correlated_suggestions: Maximale Anzahl korrelationsbasierter Vorschläge je Gebäude
             
         Returns:
             Dictionary mit Analyseergebnissen
@@ -223,8 +290,66 @@ class FinalCompletenessChecker:
             'summary': {}
         }
         
+        # Referenz-Installationen (Spalten der Korrelationsmatrix)
+        reference_installations = self.correlation_matrix.columns.tolist()
+        reference_positions = {inst: i for i, inst in enumerate(reference_installations)}
+        correlation_values = self.correlation_matrix.to_numpy(dtype=np.float32)
+        
+        # Vorhandene Installationen je Gebäude (Gebäude x Kundendatei-Installationen)
+        kunde_installations = kunde_building_installations.columns
+        present = kunde_building_installations.to_numpy() == 1
+        
+        # Mappe Kundendatei-Installationen auf Referenz-Installationen
+        mapped_references = [
+            self.installation_mapping[inst]['reference_installation']
+            if inst in self.installation_mapping and self.installation_mapping[inst]['mapped'] else None
+            for inst in kunde_installations
+        ]
+        kunde_to_reference = np.array([reference_positions.get(ref, -1) for ref in mapped_references])
+        
+        # Gemappte Installationen je Gebäude als Maske (Gebäude x Referenz-Installationen)
+        mapped_columns = np.flatnonzero(kunde_to_reference >= 0)
+        building_idx, column_idx = np.nonzero(present[:, mapped_columns])
+        existing_mask = np.zeros((len(kunde_building_installations), len(reference_installations)), dtype=bool)
+        existing_mask[building_idx, kunde_to_reference[mapped_columns[column_idx]]] = True
+        
+        # 1. Frequenzbasierte Vorschläge: häufige Installationen (absteigend nach Häufigkeit)
+        frequency = (
+            self.frequency_analysis.set_index('Installation')['Prozent']
+            .reindex(reference_installations)
+            .to_numpy()
+        )
+        high_frequency_idx = np.flatnonzero(frequency >= frequency_threshold)
+        high_frequency_idx = high_frequency_idx[np.argsort(-frequency[high_frequency_idx], kind='stable')]
+        
+        # Vorschläge für häufige Installationen sind gebäudeunabhängig -> einmal vorbereiten
+        frequency_suggestions = {}
+        for i in high_frequency_idx:
+            inst = reference_installations[i]
+            frequency_suggestions[inst] = {
+                'installation': inst,
+                'probability': frequency[i] / 100.0,
+                'reason': 'frequency',
+                'details': f"Kommt in {frequency[i]:.1f}% aller Gebäude vor",
+                'verbandsnummer': self.verbandsnummer_mapping.get(inst, '')
+            }
+        
+        # 2. Korrelationsbasierte Vorschläge: stärkste Korrelation jeder Installation mit einer
+        #    vorhandenen Installation (nur Werte über dem Schwellenwert, ohne Selbstkorrelation)
+        correlation_mask = correlation_values >= correlation_threshold
+        np.fill_diagonal(correlation_mask, False)
+        
+        best_correlation, best_correlated_with = _best_correlations(
+            existing_mask, correlation_values, correlation_mask
+        )
+        
+        # Nur die Top-k Korrelationen je Gebäude werden vorgeschlagen (stabile Sortierung: bei
+        # gleicher Korrelation gewinnt die kleinere Spalte, damit das Ergebnis reproduzierbar bleibt)
+        k = min(max_correlated_suggestions, best_correlation.shape[1])
+        top_correlated = np.argsort(-best_correlation, axis=1, kind='stable')[:, :k]
+        
         # Für jedes Gebäude in der Kundendatei
-        for building_id in kunde_building_installations.index:
+        for b, building_id in enumerate(kunde_building_installations.index):
             logger.info(f"Analysiere Gebäude: {building_id}")
             
             building_results = {
@@ -236,77 +361,40 @@ class FinalCompletenessChecker:
             }
             
             # Finde vorhandene Installationen
-            existing_installations = kunde_building_installations.loc[building_id]
-            existing_installations = existing_installations[existing_installations == 1].index.tolist()
-            building_results['existing_installations'] = existing_installations
+            existing_columns = np.flatnonzero(present[b])
+            building_results['existing_installations'] = kunde_installations[existing_columns].tolist()
             
             # Mappe vorhandene Installationen auf Referenz-Installationen
-            mapped_installations = []
-            for inst in existing_installations:
-                if inst in self.installation_mapping and self.installation_mapping[inst]['mapped']:
-                    mapped_inst = self.installation_mapping[inst]['reference_installation']
-                    mapped_installations.append(mapped_inst)
-            
+            mapped_installations = [mapped_references[k] for k in existing_columns if mapped_references[k] is not None]
             building_results['existing_mapped_installations'] = mapped_installations
             
-            # 1. Frequenzbasierte Vorschläge
-            high_frequency_installations = self.frequency_analysis[
-                self.frequency_analysis['Prozent'] >= frequency_threshold
-            ]['Installation'].tolist()
-            
             missing_high_frequency = [
-                inst for inst in high_frequency_installations 
-                if inst not in mapped_installations
+                reference_installations[i] for i in high_frequency_idx
+                if not existing_mask[b, i]
             ]
-            
             building_results['missing_high_frequency'] = missing_high_frequency
             
-            # 2. Korrelationsbasierte Vorschläge
-            missing_correlated = []
-            for existing_inst in mapped_installations:
-                if existing_inst in self.correlation_matrix.columns:
-                    # Finde Installationen, die stark mit der vorhandenen Installation korrelieren
-                    correlations = self.correlation_matrix[existing_inst].sort_values(ascending=False)
-                    high_correlations = correlations[correlations >= correlation_threshold]
-                    
-                    for correlated_inst, corr_value in high_correlations.items():
-                        if (correlated_inst not in mapped_installations and 
-                            correlated_inst != existing_inst):
-                            missing_correlated.append({
-                                'installation': correlated_inst,
-                                'correlated_with': existing_inst,
-                                'correlation': corr_value
-                            })
-            
-            # Entferne Duplikate und sortiere nach Korrelation
-            unique_correlated = {}
-            for item in missing_correlated:
-                inst = item['installation']
-                if inst not in unique_correlated or item['correlation'] > unique_correlated[inst]['correlation']:
-                    unique_correlated[inst] = item
+            # Top-k Korrelationen (nur gültige Kandidaten), sortiert nach Korrelation
+            correlated_idx = top_correlated[b]
+            correlated_idx = correlated_idx[np.isfinite(best_correlation[b, correlated_idx])]
             
-            building_results['missing_correlated'] = list(unique_correlated.values())
-            building_results['missing_correlated'].sort(key=lambda x: x['correlation'], reverse=True)
+            building_results['missing_correlated'] = [
+                {
+                    'installation': reference_installations[i],
+                    'correlated_with': reference_installations[best_correlated_with[b, i]],
+                    'correlation': float(best_correlation[b, i])
+                }
+                for i in correlated_idx
+            ]
             
             # 3. Kombinierte Vorschläge mit Wahrscheinlichkeiten
             suggestions = []
             
             # Frequenzbasierte Vorschläge
-            for inst in missing_high_frequency:
-                freq_row = self.frequency_analysis[self.frequency_analysis['Installation'] == inst]
-                if not freq_row.empty:
-                    probability = freq_row.iloc[0]['Prozent'] / 100.0
-                    verbandsnummer = self.verbandsnummer_mapping.get(inst, '')
-                    suggestions.append({
-                        'installation': inst,
-                        'probability': probability,
-                        'reason': 'frequency',
-                        'details': f"Kommt in {freq_row.iloc[0]['Prozent']:.1f}% aller Gebäude vor",
-                        'verbandsnummer': verbandsnummer
-                    })
+            suggestions.extend(dict(frequency_suggestions[inst]) for inst in missing_high_frequency)
             
             # Korrelationsbasierte Vorschläge
-            for item in building_results['missing_correlated'][:10]:  # Top 10
+            for item in building_results['missing_correlated']:
                 verbandsnummer = self.verbandsnummer_mapping.get(item['installation'], '')
                 suggestions.append({
                     'installation': item['installation'],
@@ -384,24 +472,26 @@ class FinalCompletenessChecker:
         
         if os.path.exists(bauteil_file):
             try:
-                # Prüfe ob das Sheet existiert
-                excel_file = pd.ExcelFile(bauteil_file)
-                if 'all_suggestions' in excel_file.sheet_names:
-                    # Lade alle Vorschläge aus Bauteil-Analyse
-                    bauteil_all_df = pd.read_excel(bauteil_file, sheet_name='all_suggestions')
-                    
+                # Prüfe ob das Sheet existiert (Datei wird nur einmal geöffnet)
+                with pd.ExcelFile(bauteil_file, engine="calamine") as excel_file:
+                    if 'all_suggestions' in excel_file.sheet_names:
+                        # Lade alle Vorschläge aus Bauteil-Analyse
+                        bauteil_all_df = excel_file.parse('all_suggestions')
+                    else:
+                        bauteil_all_df = None
+                
+                if bauteil_all_df is not None:
                     # Gruppiere nach Gebäude
-                    for _, row in bauteil_all_df.iterrows():
-                        gebaeude_id = row['building_id']
-                        if gebaeude_id not in bauteil_suggestions:
-                            bauteil_suggestions[gebaeude_id] = []
-                        
-                        bauteil_suggestions[gebaeude_id].append({
-                            'installation': row['component'],
-                            'probability': row['probability'],
+                    bauteil_columns = ['building_id', 'component', 'probability', 'reason', 'article_number']
+                    for gebaeude_id, component, probability, reason, article_number in (
+                        bauteil_all_df[bauteil_columns].itertuples(index=False, name=None)
+                    ):
+                        bauteil_suggestions.setdefault(gebaeude_id, []).append({
+                            'installation': component,
+                            'probability': probability,
                             'reason': 'component',
-                            'details': row['reason'],
-                            'verbandsnummer': row['article_number']
+                            'details': reason,
+                            'verbandsnummer': article_number
                         })
                     
                     logger.info(f"Bauteil-Vorschläge geladen: {len(bauteil_all_df)} Einträge")
@@ -412,37 +502,29 @@ class FinalCompletenessChecker:
         else:
             logger.info("Keine Bauteil-Vorschläge vorhanden (Datei nicht gefunden)")
         
-        # Erstelle finale zusammengeführte Vorschläge
-        final_suggestions = []
+        # Erstelle finale zusammengeführte Vorschläge (spaltenweise gesammelt)
+        final_columns = {
+            'gebaeude_id': [],
+            'installation': [],
+            'probability': [],
+            'reason': [],
+            'details': [],
+            'verbandsnummer': []
+        }
         
         for gebaeude_id, building_data in results['missing_installations'].items():
             # Sammle alle Vorschläge für dieses Gebäude
-            gebaeude_suggestions = []
-            
-            # 1. Füge Bauteil-Vorschläge hinzu (hohe Priorität)
-            if gebaeude_id in bauteil_suggestions:
-                for bauteil_suggestion in bauteil_suggestions[gebaeude_id]:
-                    gebaeude_suggestions.append({
-                        'gebaeude_id': gebaeude_id,
-                        'installation': bauteil_suggestion['installation'],
-                        'probability': bauteil_suggestion['probability'],
-                        'reason': bauteil_suggestion['reason'],
-                        'details': bauteil_suggestion['details'],
-                        'verbandsnummer': bauteil_suggestion['verbandsnummer'],
-                        'priority': 1  # Höchste Priorität
-                    })
+            # 1. Bauteil-Vorschläge (Priorität 1 = höchste Priorität)
+            gebaeude_suggestions = [
+                {'gebaeude_id': gebaeude_id, **bauteil_suggestion, 'priority': 1}
+                for bauteil_suggestion in bauteil_suggestions.get(gebaeude_id, [])
+            ]
             
-            # 2. Füge andere Vorschläge hinzu
-            for suggestion in building_data['suggestions']:
-                gebaeude_suggestions.append({
-                    'gebaeude_id': gebaeude_id,
-                    'installation': suggestion['installation'],
-                    'probability': suggestion['probability'],
-                    'reason': suggestion['reason'],
-                    'details': suggestion['details'],
-                    'verbandsnummer': suggestion['verbandsnummer'],
-                    'priority': 2  # Niedrigere Priorität
-                })
+            # 2. Andere Vorschläge (Priorität 2 = niedrigere Priorität)
+            gebaeude_suggestions.extend(
+                {'gebaeude_id': gebaeude_id, **suggestion, 'priority': 2}
+                for suggestion in building_data['suggestions']
+            )
             
             # 3. Entferne Duplikate basierend auf Verbandsnummer (Bauteil-Vorschläge priorisieren)
             unique_suggestions = {}
@@ -456,17 +538,18 @@ class FinalCompletenessChecker:
                     # Höhere Priorität (Bauteil-Vorschlag)
                     unique_suggestions[verbandsnummer] = suggestion
             
-            # 4. Füge zu finalen Vorschlägen hinzu
-            final_suggestions.extend(unique_suggestions.values())
-        
-        # Sortiere nach Gebäude-ID und Wahrscheinlichkeit
-        final_suggestions.sort(key=lambda x: (x['gebaeude_id'], -x['probability']))
+            # 4. Füge zu finalen Vorschlägen hinzu (ohne Priority-Spalte)
+            for suggestion in unique_suggestions.values():
+                for column, values in final_columns.items():
+                    values.append(suggestion[column])
         
         # Erstelle DataFrame und speichere
-        if final_suggestions:
-            final_df = pd.DataFrame(final_suggestions)
-            final_df = final_df.drop('priority', axis=1)  # Entferne Priority-Spalte
-            final_df.to_excel("03_final_results.xlsx", index=False)
+        if final_columns['gebaeude_id']:
+            # Sortiere nach Gebäude-ID und Wahrscheinlichkeit
+            final_df = pd.DataFrame(final_columns).sort_values(
+                ['gebaeude_id', 'probability'], ascending=[True, False], kind='stable'
+            )
+            final_df.to_excel("03_final_results.xlsx", index=False, engine="xlsxwriter")
             
             logger.info(f"Finale Vorschläge erstellt: {len(final_df)} Einträge")
         else:
@@ -0,0 +1,192 @@
+"""
+Gemeinsame Hilfsfunktionen der Completeness_check Pipeline.
+
+Die Referenzdaten (Gebäude-Installation Matrix, Frequenzanalyse, Korrelationsmatrix
+und Verbandsnummer-Mapping) werden hier einmal aufgebaut und in `reference.pkl`
+zwischengespeichert, damit die einzelnen Schritte sie nicht erneut berechnen müssen.
+"""
+
+import functools
+import logging
+import os
+import pickle
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+logger = logging.getLogger(__name__)
+
+# Referenzdaten (relativ zum Completeness_check Verzeichnis)
+ANLAGEN_PATH = "../cvs/Beispielobjekte.xlsx"
+ANLAGEN_SHEET = "Anlagen"
+REFERENCE_CACHE_PATH = "reference.pkl"
+
+
+@functools.lru_cache(maxsize=None)
+def load_anlagen(file_path: str = ANLAGEN_PATH, sheet_name: str = ANLAGEN_SHEET) -> pd.DataFrame:
+    """
+    Lädt das Anlagen-Sheet der Referenzdaten.
+
+    Die Excel-Datei wird nur beim ersten Lauf (oder nach einer Änderung) geparst und
+    danach als Parquet-Datei neben der Excel-Datei zwischengespeichert.
+
+    Args:
+        file_path: Pfad zur Excel-Datei
+        sheet_name: Name des Sheets
+
+    Returns:
+        DataFrame mit den Anlagen
+    """
+    cache_path = f"{os.path.splitext(file_path)[0]}_{sheet_name}.parquet"
+
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(file_path):
+        logger.info(f"Lade zwischengespeicherte Daten: {cache_path}")
+        return pd.read_parquet(cache_path)
+
+    logger.info(f"Lade Daten aus: {file_path}")
+    data = pd.read_excel(file_path, sheet_name=sheet_name, header=0, engine="calamine")
+
+    # Cache ist optional - gemischte Spaltentypen kann Parquet z.B. nicht speichern
+    try:
+        data.to_parquet(cache_path)
+    except (ValueError, TypeError) as e:
+        logger.warning(f"Konnte Daten nicht zwischenspeichern: {e}")
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+
+    return data
+
+
+def build_installation_matrix(data: pd.DataFrame) -> Tuple[sp.csr_matrix, pd.Index, pd.Index]:
+    """
+    Erstellt die Gebäude-Installation Matrix (One-Hot-Encoding) als dünn besetzte CSR-Matrix.
+
+    Returns:
+        Tuple (matrix, buildings, installations) - Zeilen sind Gebäude, Spalten Installationen
+    """
+    building_codes, buildings = pd.factorize(data["Gebäude-ID"], sort=True)
+    installation_codes, installations = pd.factorize(data["AKS-Bezeichnung"], sort=True)
+
+    # Zeilen ohne Gebäude-ID oder AKS-Bezeichnung ignorieren (wie groupby)
+    valid = (building_codes >= 0) & (installation_codes >= 0)
+
+    matrix = sp.csr_matrix(
+        (np.ones(valid.sum(), dtype=np.uint8), (building_codes[valid], installation_codes[valid])),
+        shape=(len(buildings), len(installations))
+    )
+
+    # Alles in 1/0 umwandeln (vorhanden = 1, sonst 0) - überschreibt auch übergelaufene Mehrfachzählungen
+    matrix.data[:] = 1
+
+    return matrix, buildings, installations
+
+
+def build_frequency_analysis(matrix: sp.csr_matrix, installations: pd.Index) -> pd.DataFrame:
+    """
+    Berechnet Häufigkeit und Kategorie jeder Installation über alle Gebäude.
+    """
+    installation_frequency = np.asarray(matrix.sum(axis=0, dtype=np.int64)).ravel()  # Summe über alle Gebäude
+    total_buildings = matrix.shape[0]
+    installation_percentage = (installation_frequency / total_buildings) * 100
+
+    frequency_analysis = pd.DataFrame({
+        'Installation': installations,
+        'Anzahl_Gebaeude': installation_frequency,
+        'Gesamt_Gebaeude': total_buildings,
+        'Prozent': installation_percentage
+    })
+
+    # Sortiere nach Häufigkeit (absteigend)
+    frequency_analysis = frequency_analysis.sort_values('Prozent', ascending=False)
+
+    # Definiere Kategorien basierend auf Häufigkeit
+    frequency_analysis['Kategorie'] = pd.cut(
+        frequency_analysis['Prozent'],
+        bins=[0, 10, 25, 50, 75, 100],
+        labels=['Sehr selten (0-10%)', 'Selten (10-25%)', 'Mittel (25-50%)',
+                'Häufig (50-75%)', 'Sehr häufig (75-100%)']
+    )
+
+    return frequency_analysis
+
+
+def build_correlation_matrix(matrix: sp.csr_matrix, installations: pd.Index) -> pd.DataFrame:
+    """
+    Berechnet die Pearson-Korrelation zwischen Installationen (entspricht `DataFrame.corr()`)
+    als eine einzige Matrixmultiplikation der standardisierten Gebäude-Installation Matrix.
+    """
+    values = matrix.toarray().astype(np.float32)  # float32 -> SGEMM
+    values -= values.mean(axis=0)
+
+    # Installationen in allen bzw. keinem Gebäude haben keine definierte Korrelation (NaN wie pandas)
+    std = values.std(axis=0, ddof=1)
+    std[std == 0] = np.nan
+    values /= std
+
+    correlation = (values.T @ values) / (values.shape[0] - 1)
+    np.clip(correlation, -1.0, 1.0, out=correlation)
+
+    return pd.DataFrame(correlation, index=installations, columns=installations)
+
+
+def build_verbandsnummer_mapping(data: pd.DataFrame) -> Dict[str, str]:
+    """
+    Erstellt ein Mapping zwischen AKS-Bezeichnung und Verbandsnummer.
+    """
+    if 'Verbandsnummer' not in data.columns:
+        return {}
+
+    mapping_data = data[['AKS-Bezeichnung', 'Verbandsnummer']].copy()
+    mapping_data['Verbandsnummer'] = mapping_data['Verbandsnummer'].mask(mapping_data['Verbandsnummer'] == '')
+
+    # Letzte gültige Verbandsnummer je AKS-Bezeichnung gewinnt
+    return (
+        mapping_data.dropna(subset=['Verbandsnummer'])
+        .drop_duplicates('AKS-Bezeichnung', keep='last')
+        .set_index('AKS-Bezeichnung')['Verbandsnummer']
+        .to_dict()
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def build_reference_matrix() -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, Dict[str, str]]:
+    """
+    Baut alle Referenzdaten aus `Beispielobjekte.xlsx` auf und speichert sie in `reference.pkl`.
+
+    Returns:
+        Tuple (building_installations, frequency_analysis, correlation_matrix, verbandsnummer_mapping)
+    """
+    data = load_anlagen()
+
+    matrix, buildings, installations = build_installation_matrix(data)
+    building_installations = pd.DataFrame.sparse.from_spmatrix(matrix, index=buildings, columns=installations)
+    frequency_analysis = build_frequency_analysis(matrix, installations)
+    correlation_matrix = build_correlation_matrix(matrix, installations)
+    verbandsnummer_mapping = build_verbandsnummer_mapping(data)
+
+    reference = (building_installations, frequency_analysis, correlation_matrix, verbandsnummer_mapping)
+
+    with open(REFERENCE_CACHE_PATH, 'wb') as f:
+        pickle.dump(reference, f, protocol=5)
+    logger.info(f"Referenzdaten gespeichert: {REFERENCE_CACHE_PATH}")
+
+    return reference
+
+
+def load_reference() -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, Dict[str, str]]:
+    """
+    Lädt die Referenzdaten aus `reference.pkl` oder baut sie neu auf, falls der Cache
+    fehlt oder älter als `Beispielobjekte.xlsx` ist.
+
+    Returns:
+        Tuple (building_installations, frequency_analysis, correlation_matrix, verbandsnummer_mapping)
+    """
+    if (os.path.exists(REFERENCE_CACHE_PATH)
+            and os.path.getmtime(REFERENCE_CACHE_PATH) >= os.path.getmtime(ANLAGEN_PATH)):
+        logger.info(f"Lade Referenzdaten aus: {REFERENCE_CACHE_PATH}")
+        with open(REFERENCE_CACHE_PATH, 'rb') as f:
+            return pickle.load(f)
+
+    return build_reference_matrix()
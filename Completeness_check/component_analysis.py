@@ -4,6 +4,8 @@ import logging
 import os
 from typing import Dict, List, Tuple
 
+from _shared import load_anlagen
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -22,12 +24,9 @@ class ComponentAnalyzer:
         """
         logger.info("Loading reference data...")
         
-        # Load example objects
-        file_path = "../cvs/Beispielobjekte.xlsx"
-        sheet_name = "Anlagen"
-        
         try:
-            data = pd.read_excel(file_path, sheet_name=sheet_name, header=0, engine="openpyxl")
+            # Shared loader (calamine, cached as Parquet after the first run)
+            data = load_anlagen()
             logger.info(f"Reference data loaded: {len(data)} rows")
         except Exception as e:
             logger.error(f"Error loading reference data: {e}")
@@ -40,6 +39,9 @@ class ComponentAnalyzer:
             logger.error(f"Missing columns in reference data: {missing_columns}")
             return False
         
+        # Anlagentyp is only used for filtering -> Arrow strings (comparisons run as Arrow kernels)
+        data = data.astype({'Anlagentyp': 'string[pyarrow]'})
+        
         # Create system-component mapping
         self._create_system_component_mapping(data)
         
@@ -51,46 +53,40 @@ class ComponentAnalyzer:
         """
         logger.info("Creating system-component mapping...")
         
-        # 1. Find all systems with association number
-        systems_with_association = data[
-            (data['Anlagentyp'] == 'Anlage') & 
-            (data['Verbandsnummer'].notna()) & 
-            (data['Verbandsnummer'] != '')
-        ].copy()
+        # 1. Entries with association number (mask computed once), split by type in one pass
+        has_association_number = data['Verbandsnummer'].notna() & data['Verbandsnummer'].ne('')
+        by_type = dict(tuple(data[has_association_number].groupby('Anlagentyp', sort=False)))
         
+        systems_with_association = by_type.get('Anlage', data.iloc[:0])
         logger.info(f"Systems with association number found: {len(systems_with_association)}")
         
-        # 2. Find all components with association number
-        components_with_association = data[
-            (data['Anlagentyp'] == 'Bauteil') & 
-            (data['Verbandsnummer'].notna()) & 
-            (data['Verbandsnummer'] != '')
-        ].copy()
+        # 2. All components with association number
+        components_with_association = by_type.get('Bauteil', data.iloc[:0])
         
         logger.info(f"Components with association number found: {len(components_with_association)}")
         
-        # 3. Create mapping: System -> [Components]
+        # 3. Group components by their parent system in one pass: System-ID -> [Components]
+        component_records = components_with_association.rename(columns={
+            'Anlagen-ID': 'component_id',
+            'AKS-Bezeichnung': 'aks_designation',
+            'Verbandsnummer': 'association_number'
+        })
+        component_groups = {
+            system_id: group.to_dict('records')
+            for system_id, group in component_records.groupby('Bauteil der Anlage', sort=False)[
+                ['component_id', 'aks_designation', 'association_number']
+            ]
+        }
+        
+        # 4. Create mapping: Association number -> System with its components
         system_component_dict = {}
         
-        for _, system in systems_with_association.iterrows():
-            system_id = system['Anlagen-ID']
-            association_number = system['Verbandsnummer']
-            aks_designation = system['AKS-Bezeichnung']
-            
-            # Find all components that belong to this system
-            related_components = components_with_association[
-                components_with_association['Bauteil der Anlage'] == system_id
-            ]
+        for system_id, association_number, aks_designation in systems_with_association[
+            ['Anlagen-ID', 'Verbandsnummer', 'AKS-Bezeichnung']
+        ].itertuples(index=False):
+            component_list = component_groups.get(system_id)
             
-            if len(related_components) > 0:
-                component_list = []
-                for _, component in related_components.iterrows():
-                    component_list.append({
-                        'component_id': component['Anlagen-ID'],
-                        'aks_designation': component['AKS-Bezeichnung'],
-                        'association_number': component['Verbandsnummer']
-                    })
-                
+            if component_list:
                 system_component_dict[association_number] = {
                     'system_id': system_id,
                     'aks_designation': aks_designation,
@@ -109,7 +105,7 @@ class ComponentAnalyzer:
         logger.info(f"Loading customer file: {customer_file_path}")
         
         try:
-            self.customer_data = pd.read_excel(customer_file_path)
+            self.customer_data = pd.read_excel(customer_file_path, engine="calamine")
             logger.info(f"Customer file loaded: {len(self.customer_data)} rows")
             
             # Check if WirtEinh column exists
@@ -133,78 +129,101 @@ class ComponentAnalyzer:
             logger.error("Customer file not loaded!")
             return {}
         
-        # Group by buildings
-        building_groups = self.customer_data.groupby('WirtEinh')
+        # Columns that can contain an article number (various column names possible)
+        article_number_columns = [
+            col for col in self.customer_data.columns
+            if 'artikel' in col.lower() or 'verband' in col.lower()
+        ]
+        
+        # Rows without building are ignored (like groupby)
+        customer_data = self.customer_data[self.customer_data['WirtEinh'].notna()]
+        building_ids = customer_data['WirtEinh'].to_numpy()
+        values = customer_data[article_number_columns].to_numpy(dtype=object)
+        present = (
+            customer_data[article_number_columns].notna().to_numpy(dtype=bool)
+            & (customer_data[article_number_columns] != '').to_numpy(dtype=bool, na_value=False)
+        )
+        
+        # 1. Find systems with article number (only the first found article number per row)
+        has_article_number = present.any(axis=1)
+        system_rows = np.flatnonzero(has_article_number)
+        first_column = present[system_rows].argmax(axis=1) if article_number_columns else system_rows
+        
+        if 'AKS-Bezeichnung' in customer_data.columns:
+            aks_designations = customer_data['AKS-Bezeichnung'].to_numpy()[system_rows]
+        else:
+            aks_designations = 'Unknown'
+        
+        systems = pd.DataFrame({
+            'WirtEinh': building_ids[system_rows],
+            'aks_designation': aks_designations,
+            'article_number': values[system_rows, first_column],
+            'column': np.array(article_number_columns, dtype=object)[first_column]
+        })
+        
+        # All article numbers present per building (long form)
+        existing_rows, existing_columns = np.nonzero(present)
+        existing_components = pd.DataFrame({
+            'WirtEinh': building_ids[existing_rows],
+            'component_article_number': values[existing_rows, existing_columns]
+        }).drop_duplicates()
+        
+        # 2. Find missing components: expected components per system minus existing ones (anti-join)
+        mapping_df = pd.DataFrame(
+            [
+                (association_number, system_data['aks_designation'],
+                 component['aks_designation'], component['association_number'])
+                for association_number, system_data in self.system_component_mapping.items()
+                for component in system_data['components']
+            ],
+            columns=['system_article_number', 'system_aks', 'component_aks', 'component_article_number'],
+            dtype=object
+        )
+        
+        expected_components = systems[['WirtEinh', 'article_number']].merge(
+            mapping_df, left_on='article_number', right_on='system_article_number', how='inner'
+        )
+        missing = expected_components.merge(
+            existing_components, on=['WirtEinh', 'component_article_number'], how='left', indicator=True
+        )
+        missing = missing[missing['_merge'] == 'left_only']
+        missing = missing.assign(reason='Belongs to system: ' + missing['system_aks'].astype(str))
+        
+        systems_by_building = {
+            building_id: group.to_dict('records')
+            for building_id, group in systems.groupby('WirtEinh', sort=False)[
+                ['aks_designation', 'article_number', 'column']
+            ]
+        }
+        missing_by_building = {
+            building_id: group.to_dict('records')
+            for building_id, group in missing.groupby('WirtEinh', sort=False)[
+                ['system_aks', 'system_article_number', 'component_aks', 'component_article_number', 'reason']
+            ]
+        }
         
+        # 3. Assemble results and suggestions per building
         results = {}
         
-        for building_id, building_data in building_groups:
-            logger.info(f"Analyzing building: {building_id}")
+        for building_id in customer_data.groupby('WirtEinh').size().index:
+            missing_components = missing_by_building.get(building_id, [])
             
-            building_results = {
+            results[building_id] = {
                 'building_id': building_id,
-                'systems_with_article_number': [],
-                'missing_components': [],
-                'suggestions': []
+                'systems_with_article_number': systems_by_building.get(building_id, []),
+                'missing_components': missing_components,
+                'suggestions': [
+                    {
+                        'component': component['component_aks'],
+                        'article_number': component['component_article_number'],
+                        'reason': component['reason'],
+                        'probability': 0.9  # High probability due to direct assignment
+                    }
+                    for component in missing_components
+                ]
             }
-            
-            # 1. Find systems with article number
-            systems_with_article_number = []
-            for _, row in building_data.iterrows():
-                # Check if article number is present (can have various column names)
-                article_number_columns = [col for col in self.customer_data.columns if 'artikel' in col.lower() or 'verband' in col.lower()]
-                
-                for column in article_number_columns:
-                    if pd.notna(row[column]) and row[column] != '':
-                        systems_with_article_number.append({
-                            'aks_designation': row.get('AKS-Bezeichnung', 'Unknown'),
-                            'article_number': row[column],
-                            'column': column
-                        })
-                        break  # Use only the first found article number
-            
-            building_results['systems_with_article_number'] = systems_with_article_number
-            
-            # 2. Find missing components
-            missing_components = []
-            
-            for system in systems_with_article_number:
-                article_number = system['article_number']
-                
-                # Check if this article number corresponds to a system with components
-                if article_number in self.system_component_mapping:
-                    system_data = self.system_component_mapping[article_number]
-                    
-                    # Check which components are already present
-                    existing_components = []
-                    for _, row in building_data.iterrows():
-                        for column in article_number_columns:
-                            if pd.notna(row[column]) and row[column] != '':
-                                existing_components.append(row[column])
-                    
-                    # Find missing components
-                    for component in system_data['components']:
-                        if component['association_number'] not in existing_components:
-                            missing_components.append({
-                                'system_aks': system_data['aks_designation'],
-                                'system_article_number': article_number,
-                                'component_aks': component['aks_designation'],
-                                'component_article_number': component['association_number'],
-                                'reason': f"Belongs to system: {system_data['aks_designation']}"
-                            })
-            
-            building_results['missing_components'] = missing_components
-            
-            # 3. Create suggestions
-            for component in missing_components:
-                building_results['suggestions'].append({
-                    'component': component['component_aks'],
-                    'article_number': component['component_article_number'],
-                    'reason': component['reason'],
-                    'probability': 0.9  # High probability due to direct assignment
-                })
-            
-            results[building_id] = building_results
+        
+        logger.info(f"Analyzed buildings: {len(results)}")
         
         return results
     
@@ -219,56 +238,47 @@ class ComponentAnalyzer:
         # Create Excel writer
         output_file = f"{output_dir}/component_suggestions.xlsx"
         
-        with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
-            # 1. Overview
-            overview_data = []
-            for building_id, building_data in results.items():
-                overview_data.append({
-                    'Building_ID': building_id,
-                    'Systems_with_Article_Number': len(building_data['systems_with_article_number']),
-                    'Missing_Components': len(building_data['missing_components']),
-                    'Suggestions': len(building_data['suggestions'])
-                })
-            
-            overview_df = pd.DataFrame(overview_data)
+        # 1. Overview
+        overview_df = pd.DataFrame({
+            'Building_ID': list(results.keys()),
+            'Systems_with_Article_Number': [len(b['systems_with_article_number']) for b in results.values()],
+            'Missing_Components': [len(b['missing_components']) for b in results.values()],
+            'Suggestions': [len(b['suggestions']) for b in results.values()]
+        })
+        
+        # 2. All suggestions together (built once, per-building sheets are slices of it)
+        all_suggestions_df = pd.DataFrame(
+            [
+                {'building_id': building_id, **suggestion}
+                for building_id, building_data in results.items()
+                for suggestion in building_data['suggestions']
+            ],
+            columns=['building_id', 'component', 'article_number', 'reason', 'probability']
+        )
+        building_suggestions = dict(tuple(
+            all_suggestions_df.drop(columns='building_id')
+            .rename(columns={
+                'component': 'Component',
+                'article_number': 'Article_Number',
+                'reason': 'Reason',
+                'probability': 'Probability'
+            })
+            .groupby(all_suggestions_df['building_id'], sort=False)
+        ))
+        
+        # Empty table for buildings without suggestions
+        empty_df = pd.DataFrame(columns=['Component', 'Article_Number', 'Reason', 'Probability'])
+        
+        with pd.ExcelWriter(output_file, engine='xlsxwriter') as writer:
             overview_df.to_excel(writer, sheet_name='overview', index=False)
             
-            # 2. Detailed analysis per building
-            for building_id, building_data in results.items():
+            # Detailed analysis per building
+            for building_id in results:
                 sheet_name = f"Building_{building_id}"[:31]  # Excel sheet names max 31 characters
-                
-                # Create DataFrame for this building
-                building_suggestions = []
-                for suggestion in building_data['suggestions']:
-                    building_suggestions.append({
-                        'Component': suggestion['component'],
-                        'Article_Number': suggestion['article_number'],
-                        'Reason': suggestion['reason'],
-                        'Probability': suggestion['probability']
-                    })
-                
-                if building_suggestions:
-                    building_df = pd.DataFrame(building_suggestions)
-                    building_df.to_excel(writer, sheet_name=sheet_name, index=False)
-                else:
-                    # Empty table for buildings without suggestions
-                    empty_df = pd.DataFrame(columns=['Component', 'Article_Number', 'Reason', 'Probability'])
-                    empty_df.to_excel(writer, sheet_name=sheet_name, index=False)
-            
-            # 3. All suggestions together
-            all_suggestions = []
-            for building_id, building_data in results.items():
-                for suggestion in building_data['suggestions']:
-                    all_suggestions.append({
-                        'building_id': building_id,
-                        'component': suggestion['component'],
-                        'article_number': suggestion['article_number'],
-                        'reason': suggestion['reason'],
-                        'probability': suggestion['probability']
-                    })
+                building_df = building_suggestions.get(building_id, empty_df)
+                building_df.to_excel(writer, sheet_name=sheet_name, index=False)
             
-            if all_suggestions:
-                all_suggestions_df = pd.DataFrame(all_suggestions)
+            if not all_suggestions_df.empty:
                 all_suggestions_df.to_excel(writer, sheet_name='all_suggestions', index=False)
         
         logger.info(f"✓ Component analysis results saved: {output_file}")
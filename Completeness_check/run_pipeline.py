@@ -12,11 +12,13 @@ Autor: AI Assistant
 Datum: 2024
 """
 
-import subprocess
+import argparse
+import runpy
 import sys
 import os
 import logging
 from pathlib import Path
+from typing import List
 
 # Logging konfigurieren
 logging.basicConfig(
@@ -29,9 +31,29 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def is_up_to_date(outputs: List[str], inputs: List[str]) -> bool:
+    """
+    Prüft ob alle Ausgabedateien existieren und neuer als alle Eingabedateien sind.
+    
+    Args:
+        outputs: Ausgabedateien des Schritts
+        inputs: Eingabedateien des Schritts (inkl. Skript)
+        
+    Returns:
+        True wenn der Schritt übersprungen werden kann
+    """
+    if not all(os.path.exists(path) for path in outputs):
+        return False
+    
+    oldest_output = min(os.path.getmtime(path) for path in outputs)
+    return all(os.path.getmtime(path) <= oldest_output for path in inputs if os.path.exists(path))
+
 def run_script(script_name: str, description: str) -> bool:
     """
-    Führt ein Python-Skript aus und gibt True zurück, wenn es erfolgreich war.
+    Führt ein Python-Skript im laufenden Interpreter aus und gibt True zurück, wenn es erfolgreich war.
+    
+    pandas, numpy, torch und sentence-transformers werden so nur einmal importiert,
+    statt für jeden Schritt einen neuen Python-Prozess zu starten.
     
     Args:
         script_name: Name des Skripts (z.B. "01_correlation_matrix.py")
@@ -43,33 +65,30 @@ def run_script(script_name: str, description: str) -> bool:
     logger.info(f"=== STARTE: {description} ===")
     logger.info(f"Führe aus: {script_name}")
     
+    # Skripte mit eigenen Kommandozeilenargumenten sollen die Argumente der Pipeline nicht sehen
+    original_argv = sys.argv
+    sys.argv = [script_name]
+    
     try:
-        # Führe Skript aus
-        result = subprocess.run(
-            [sys.executable, script_name],
-            capture_output=True,
-            text=True,
-            cwd=Path(__file__).parent
-        )
+        runpy.run_path(script_name, run_name="__main__")
+        logger.info(f"✓ ERFOLGREICH: {description}")
+        return True
         
-        if result.returncode == 0:
+    except SystemExit as e:
+        if e.code in (None, 0):
             logger.info(f"✓ ERFOLGREICH: {description}")
-            if result.stdout:
-                logger.info(f"Ausgabe:\n{result.stdout}")
             return True
-        else:
-            logger.error(f"✗ FEHLER: {description}")
-            logger.error(f"Return Code: {result.returncode}")
-            if result.stderr:
-                logger.error(f"Fehlerausgabe:\n{result.stderr}")
-            if result.stdout:
-                logger.info(f"Standardausgabe:\n{result.stdout}")
-            return False
-            
+        logger.error(f"✗ FEHLER: {description}")
+        logger.error(f"Return Code: {e.code}")
+        return False
+        
     except Exception as e:
-        logger.error(f"✗ AUSNAHME: {description}")
+        logger.exception(f"✗ AUSNAHME: {description}")
         logger.error(f"Fehler: {e}")
         return False
+        
+    finally:
+        sys.argv = original_argv
 
 def check_prerequisites() -> bool:
     """
@@ -115,6 +134,13 @@ def main():
     """
     Hauptfunktion - führt die gesamte Pipeline aus.
     """
+    parser = argparse.ArgumentParser(description="Completeness_check Pipeline ausführen")
+    parser.add_argument("--force", action="store_true", help="Alle Schritte ausführen, auch wenn die Ergebnisse aktuell sind")
+    args = parser.parse_args()
+    
+    # Alle Skripte erwarten das Completeness_check Verzeichnis als Arbeitsverzeichnis
+    os.chdir(Path(__file__).parent)
+    
     logger.info("=== COMPLETENESS_CHECK PIPELINE STARTET ===")
     logger.info(f"Aktuelles Verzeichnis: {os.getcwd()}")
     
@@ -123,23 +149,35 @@ def main():
         logger.error("Voraussetzungen nicht erfüllt! Pipeline wird abgebrochen.")
         sys.exit(1)
     
-    # Pipeline-Schritte
+    # Pipeline-Schritte (Eingaben/Ausgaben zum Überspringen bereits aktueller Schritte)
+    reference_inputs = ["../cvs/Beispielobjekte.xlsx", "_shared.py"]
     pipeline_steps = [
         {
             "script": "01_correlation_matrix.py",
-            "description": "Korrelationsmatrix erstellen"
+            "description": "Korrelationsmatrix erstellen",
+            "inputs": reference_inputs,
+            "outputs": ["01_correlation_matrix.parquet"]
         },
         {
             "script": "02_frequency_analysis.py", 
-            "description": "Frequenzanalyse durchführen"
+            "description": "Frequenzanalyse durchführen",
+            "inputs": reference_inputs,
+            "outputs": ["02_frequency_analysis.parquet"]
         },
         {
             "script": "component_analysis.py",
-            "description": "Komponenten-Analyse"
+            "description": "Komponenten-Analyse",
+            "inputs": reference_inputs + ["../cvs/Kundendatei.xlsx"],
+            "outputs": ["component_analysis_results/component_suggestions.xlsx"]
         },
         {
             "script": "03_completeness_check.py",
-            "description": "Finale Vollständigkeitsprüfung"
+            "description": "Finale Vollständigkeitsprüfung",
+            "inputs": reference_inputs + [
+                "../cvs/Kundendatei.xlsx",
+                "component_analysis_results/component_suggestions.xlsx"
+            ],
+            "outputs": ["03_final_results.xlsx"]
         }
     ]
     
@@ -150,7 +188,10 @@ def main():
     for i, step in enumerate(pipeline_steps, 1):
         logger.info(f"\n--- SCHRITT {i}/{total_steps} ---")
         
-        if run_script(step["script"], step["description"]):
+        if not args.force and is_up_to_date(step["outputs"], step["inputs"] + [step["script"]]):
+            logger.info(f"↷ ÜBERSPRUNGEN (Ergebnisse aktuell): {step['description']}")
+            success_count += 1
+        elif run_script(step["script"], step["description"]):
             success_count += 1
         else:
             logger.error(f"Pipeline-Schritt {i} fehlgeschlagen!")
@@ -164,8 +205,8 @@ def main():
     if success_count == total_steps:
         logger.info("🎉 ALLE SCHRITTE ERFOLGREICH!")
         logger.info("\n=== ERWARTETE AUSGABEDATEIEN ===")
-        logger.info("✓ 01_correlation_matrix.xlsx")
-        logger.info("✓ 02_frequency_analysis.xlsx") 
+        logger.info("✓ 01_correlation_matrix.parquet")
+        logger.info("✓ 02_frequency_analysis.parquet")
         logger.info("✓ component_analysis_results/component_suggestions.xlsx")
         logger.info("✓ 03_final_results.xlsx")
         logger.info("\nPipeline erfolgreich abgeschlossen! 🚀")
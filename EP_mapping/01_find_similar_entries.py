@@ -1,29 +1,122 @@
 import pandas as pd
 import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 import torch
-from typing import List, Dict
+from typing import List, Dict, Tuple
 import logging
+import hashlib
 import json
 import os
 
+from _shared import load_table
+
 # Logging konfigurieren
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class SimilarityFinder:
-    def __init__(self, model_name: str = 'T-Systems-onsite/cross-en-de-roberta-sentence-transformer'):
+    def __init__(self, model_name: str = 'T-Systems-onsite/cross-en-de-roberta-sentence-transformer',
+                 embedding_cache_dir: str = "embedding_cache"):
         """
         Initialisiert den Similarity Finder mit einem Sentence Transformer Modell.
         
         Args:
             model_name: Name des zu verwendenden Sentence Transformer Modells
+            embedding_cache_dir: Verzeichnis für zwischengespeicherte Embeddings
         """
+        self.model_name = model_name
         self.model = SentenceTransformer(model_name)
+        self.embedding_cache_dir = embedding_cache_dir
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        
+        # Auf der GPU in fp16 rechnen (Tensor Cores, halber Speicher für Aktivierungen)
+        if self.device == 'cuda':
+            self.model = self.model.half()
+        
         logger.info(f"Verwende Modell: {model_name} auf {self.device}")
+    
+    def _get_or_compute_embeddings(self, texts: List[str]) -> np.ndarray:
+        """
+        Lädt die Embeddings der Texte aus dem Cache oder berechnet sie.
+        
+        Der Cache-Schlüssel setzt sich aus Modellname und Texten zusammen,
+        sodass eine geänderte Kundendatei automatisch neu berechnet wird.
+        
+        Args:
+            texts: Liste der zu kodierenden Texte
+            
+        Returns:
+            Normierte Embeddings der Texte (float32)
+        """
+        key = hashlib.sha1((self.model_name + "\0" + "\0".join(texts)).encode('utf-8')).hexdigest()
+        cache_path = os.path.join(self.embedding_cache_dir, f"{key}_normalized.npy")
         
+        if os.path.exists(cache_path):
+            logger.info(f"Lade Embeddings aus Cache: {cache_path}")
+            return np.load(cache_path)
+        
+        logger.info("Berechne Embeddings...")
+        with torch.inference_mode():
+            embeddings = self.model.encode(
+                texts,
+                batch_size=256,
+                normalize_embeddings=True,
+                convert_to_numpy=True,
+                show_progress_bar=True,
+                device=self.device
+            )
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        
+        os.makedirs(self.embedding_cache_dir, exist_ok=True)
+        np.save(cache_path, embeddings)
+        logger.info(f"Embeddings gespeichert: {cache_path}")
+        
+        return embeddings
+        
+    def _find_similar_pairs(self, embeddings: np.ndarray, similarity_threshold: float,
+                            block_size: int = 4096) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Findet alle Paare (i, j) mit i != j, deren Cosinus-Ähnlichkeit den Schwellenwert erreicht.
+        
+        Die Embeddings sind normiert, die Ähnlichkeit ist also ein Skalarprodukt. Sie wird
+        zeilenblockweise auf dem Gerät berechnet (GPU in fp16), sodass nie die volle N x N Matrix
+        im Speicher liegt. Nur die Indizes der gefundenen Paare werden zurückkopiert.
+        
+        Args:
+            embeddings: Normierte Embeddings (N x D)
+            similarity_threshold: Schwellenwert für Ähnlichkeit (0-1)
+            block_size: Anzahl Zeilen pro Block
+            
+        Returns:
+            Tuple (rows, cols) der ähnlichen Paare, sortiert nach Zeile und Spalte
+        """
+        dtype = torch.float16 if self.device == 'cuda' else torch.float32
+        embeddings_tensor = torch.from_numpy(np.ascontiguousarray(embeddings)).to(self.device, dtype=dtype)
+        n_entries = len(embeddings_tensor)
+        
+        # Ein Puffer für alle Blöcke: Spitzenspeicher block_size x N statt N x N
+        block_buffer = torch.empty((min(block_size, n_entries), n_entries), device=self.device, dtype=dtype)
+        
+        rows = [torch.empty(0, dtype=torch.int64, device=self.device)]
+        cols = [torch.empty(0, dtype=torch.int64, device=self.device)]
+        
+        with torch.inference_mode():
+            for start in range(0, n_entries, block_size):
+                block = embeddings_tensor[start:start + block_size]
+                similarity_block = torch.matmul(block, embeddings_tensor.T, out=block_buffer[:len(block)])
+                
+                # WICHTIG: Setze Diagonale auf 0 (Eintrag mit sich selbst)
+                similarity_block.diagonal(offset=start).fill_(0)
+                
+                # Kanten bleiben auf dem Gerät und werden am Ende einmal übertragen
+                block_rows, block_cols = (similarity_block >= similarity_threshold).nonzero(as_tuple=True)
+                rows.append(block_rows + start)
+                cols.append(block_cols)
+        
+        return torch.cat(rows).cpu().numpy(), torch.cat(cols).cpu().numpy()
+    
     def find_similar_entries(self, kundendatei_path: str, similarity_threshold: float = 0.97) -> tuple[Dict[int, List[int]], pd.DataFrame]:
         """
         Findet ähnliche Einträge in der Kundendatei und gruppiert sie.
@@ -36,64 +129,60 @@ class SimilarityFinder:
             Dictionary mit {representative_index: [similar_indices]}
         """
         logger.info("Lade Kundendatei...")
-        df = pd.read_excel(kundendatei_path)
+        df = load_table(kundendatei_path)
         
         # Alle Textspalten kombinieren für den Vergleich
         text_columns = df.select_dtypes(include=['object']).columns
         logger.info(f"Gefundene Textspalten: {list(text_columns)}")
         
-        # Kombiniere alle Textspalten zu einem String
-        df['combined_text'] = df[text_columns].fillna('').astype(str).agg(' '.join, axis=1)
+        # Kombiniere alle Textspalten zu einem String (vektorisiert über Arrow-Strings)
+        if len(text_columns) == 0:
+            df['combined_text'] = ''
+        else:
+            text_data = df[text_columns].astype("string[pyarrow]")
+            df['combined_text'] = text_data[text_columns[0]].str.cat(
+                [text_data[col] for col in text_columns[1:]], sep=' ', na_rep=''
+            )
         
-        # Berechne Embeddings für alle Einträge
-        logger.info("Berechne Embeddings...")
+        # Berechne Embeddings für alle Einträge (zwischengespeichert für weitere Läufe)
         texts = df['combined_text'].tolist()
-        embeddings = self.model.encode(texts, show_progress_bar=True, device=self.device)
+        embeddings = self._get_or_compute_embeddings(texts)
         
-        # Berechne Cosinus-Ähnlichkeit zwischen allen Paaren
+        # Berechne ähnliche Paare (Cosinus-Ähnlichkeit als Matrixmultiplikation, ohne Selbst-Paare)
         logger.info("Berechne Ähnlichkeitsmatrix...")
-        similarity_matrix = cosine_similarity(embeddings)
+        rows, cols = self._find_similar_pairs(embeddings, similarity_threshold)
         
-        # WICHTIG: Setze Diagonale auf 0 (Eintrag mit sich selbst)
-        np.fill_diagonal(similarity_matrix, 0)
+        # Keine Zeile darf gegen sich selbst gemappt werden (entfällt mit python -O)
+        assert not np.any(rows == cols), "Diagonale wurde nicht korrekt auf 0 gesetzt"
         
-        # Überprüfe, dass keine Zeile gegen sich selbst gemappt wird
-        diagonal_values = np.diag(similarity_matrix)
-        if np.any(diagonal_values != 0):
-            logger.error("FEHLER: Diagonale enthält noch Werte ungleich 0!")
-            raise ValueError("Diagonale wurde nicht korrekt auf 0 gesetzt")
-        else:
-            logger.info("✓ Diagonale korrekt auf 0 gesetzt - keine Selbst-Mappings")
-        
-        # Finde ähnliche Einträge
+        # Finde ähnliche Einträge: Zusammenhangskomponenten des Ähnlichkeitsgraphen
+        # (transitiv ähnliche Einträge landen in derselben Gruppe, unabhängig von der Reihenfolge)
         logger.info("Finde ähnliche Einträge...")
+        n_entries = len(embeddings)
+        adjacency = coo_matrix((np.ones(len(rows), dtype=bool), (rows, cols)), shape=(n_entries, n_entries))
+        _, labels = connected_components(adjacency, directed=False)
+        
+        # Indizes je Gruppe (aufsteigend); der kleinste Index ist der Repräsentant
+        order = np.argsort(labels, kind='stable')
+        groups = np.split(order, np.flatnonzero(np.diff(labels[order])) + 1) if n_entries else []
+        groups.sort(key=lambda group: group[0])
+        
         similar_groups = {}
-        processed_indices = set()
         
-        for i in range(len(similarity_matrix)):
-            if i in processed_indices:
-                continue
+        for group in groups:
+            if len(group) > 1:
+                representative, similar_indices = int(group[0]), group[1:].tolist()
                 
-            # Finde alle ähnlichen Einträge für Index i (ohne den repräsentativen Index selbst)
-            similar_indices = np.where(similarity_matrix[i] >= similarity_threshold)[0]
-            # Entferne den repräsentativen Index aus den ähnlichen Indizes
-            similar_indices = similar_indices[similar_indices != i]
-            
-            if len(similar_indices) > 0:
                 # Speichere nur die ähnlichen Indizes (ohne repräsentativen Index)
-                similar_groups[i] = similar_indices.tolist()
-                
-                # Markiere alle Indizes als verarbeitet
-                processed_indices.add(i)
-                processed_indices.update(similar_indices)
+                similar_groups[representative] = similar_indices
                 
-                logger.info(f"Gruppe gefunden: Repräsentant {i} mit {len(similar_indices)} ähnlichen Einträgen")
-                logger.info(f"  Ähnliche Indizes: {similar_indices.tolist()}")
+                logger.info(f"Gruppe gefunden: Repräsentant {representative} mit {len(similar_indices)} ähnlichen Einträgen")
+                logger.info(f"  Ähnliche Indizes: {similar_indices}")
         
         # Füge einzelne Einträge hinzu (die keine ähnlichen haben)
-        for i in range(len(similarity_matrix)):
-            if i not in processed_indices:
-                similar_groups[i] = []
+        for group in groups:
+            if len(group) == 1:
+                similar_groups[int(group[0])] = []
         
         logger.info(f"Insgesamt {len(similar_groups)} Gruppen gefunden")
         
@@ -171,7 +260,8 @@ class SimilarityFinder:
         logger.info(f"  - {total_entries} ursprüngliche Einträge")
         logger.info(f"  - {reduction_percentage:.1f}% Reduktion")
 
-if __name__ == "__main__":
+def main():
+    """Hauptfunktion."""
     finder = SimilarityFinder()
     
     # Finde ähnliche Einträge
@@ -182,4 +272,7 @@ if __name__ == "__main__":
     finder.save_similarity_results(similar_groups, kundendatei_df)
     
     logger.info("=== SCHRITT 1 ABGESCHLOSSEN ===")
-    logger.info("Bereit für Schritt 2: EP-Überschriften Mapping") 
\ No newline at end of file
+    logger.info("Bereit für Schritt 2: EP-Überschriften Mapping") 
+
+if __name__ == "__main__":
+    main()
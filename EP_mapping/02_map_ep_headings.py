@@ -1,29 +1,77 @@
 import pandas as pd
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+from sentence_transformers import SentenceTransformer, util
 import torch
 from typing import List, Dict
 import logging
+import hashlib
 import json
 import os
 
+from _shared import heading_mask, load_table
+
 # Logging konfigurieren
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class EPHeadingMapper:
-    def __init__(self, model_name: str = 'T-Systems-onsite/cross-en-de-roberta-sentence-transformer'):
+    def __init__(self, model_name: str = 'T-Systems-onsite/cross-en-de-roberta-sentence-transformer',
+                 embedding_cache_dir: str = "embedding_cache"):
         """
         Initialisiert den EP Heading Mapper mit einem Sentence Transformer Modell.
         
         Args:
             model_name: Name des zu verwendenden Sentence Transformer Modells
+            embedding_cache_dir: Verzeichnis für zwischengespeicherte EP-Embeddings
         """
+        self.model_name = model_name
         self.model = SentenceTransformer(model_name)
+        self.embedding_cache_dir = embedding_cache_dir
+        self.representative_df = None
+        self._representative_key = None
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        
+        # Auf der GPU in fp16 rechnen (Tensor Cores, halber Speicher für Aktivierungen)
+        if self.device == 'cuda':
+            self.model = self.model.half()
+        
         logger.info(f"Verwende Modell: {model_name} auf {self.device}")
     
+    def _get_or_compute_ep_embeddings(self, ep_texts: List[str]) -> torch.Tensor:
+        """
+        Lädt die normierten Embeddings der EP-Überschriften aus dem Cache oder berechnet sie.
+        
+        Der Cache-Schlüssel setzt sich aus Modellname und Überschriften zusammen, sodass ein
+        geänderter EP-Katalog automatisch neu berechnet wird. Gespeichert wird in float16.
+        
+        Args:
+            ep_texts: Liste der EP-Überschriften
+            
+        Returns:
+            Normierte Embeddings der EP-Überschriften auf dem Gerät des Modells
+        """
+        key = hashlib.sha1((self.model_name + "\0" + "\0".join(ep_texts)).encode('utf-8')).hexdigest()
+        cache_path = os.path.join(self.embedding_cache_dir, f"{key}_ep_fp16.npy")
+        
+        if os.path.exists(cache_path):
+            logger.info(f"Lade EP-Embeddings aus Cache: {cache_path}")
+            emb_ep = np.load(cache_path)
+        else:
+            logger.info("Berechne Embeddings für EP-Überschriften...")
+            with torch.inference_mode():
+                emb_ep = self.model.encode(
+                    ep_texts, batch_size=256, normalize_embeddings=True, convert_to_numpy=True,
+                    show_progress_bar=True, device=self.device
+                ).astype(np.float16)
+            
+            os.makedirs(self.embedding_cache_dir, exist_ok=True)
+            np.save(cache_path, emb_ep)
+            logger.info(f"EP-Embeddings gespeichert: {cache_path}")
+        
+        # Gleicher Datentyp wie die Kundendatei-Embeddings (fp16 auf der GPU)
+        dtype = torch.float16 if self.device == 'cuda' else torch.float32
+        return torch.from_numpy(emb_ep.astype(np.float32)).to(self.device, dtype=dtype)
+    
     def load_similarity_results(self, input_dir: str = "intermediate_results") -> Dict[int, List[int]]:
         """
         Lädt die Ähnlichkeitsergebnisse aus Schritt 1.
@@ -47,6 +95,9 @@ class EPHeadingMapper:
         """
         Erstellt einen DataFrame mit nur den repräsentativen Einträgen.
         
+        Der DataFrame wird einmal aufgebaut und auf der Instanz zwischengespeichert, sodass
+        create_reduced_kundendatei die Kundendatei nicht erneut lädt.
+        
         Args:
             kundendatei_path: Pfad zur Kundendatei
             similar_groups: Dictionary mit den ähnlichen Gruppen
@@ -54,7 +105,11 @@ class EPHeadingMapper:
         Returns:
             DataFrame mit repräsentativen Einträgen
         """
-        df = pd.read_excel(kundendatei_path)
+        representative_key = (kundendatei_path, tuple(similar_groups.items()))
+        if self._representative_key == representative_key:
+            return self.representative_df
+        
+        df = load_table(kundendatei_path)
         
         # Erstelle DataFrame mit repräsentativen Einträgen
         representative_indices = list(similar_groups.keys())
@@ -64,11 +119,13 @@ class EPHeadingMapper:
         representative_df.index = representative_indices
         
         # Füge Mapping-Informationen hinzu
-        representative_df['original_indices'] = [similar_groups[idx] for idx in representative_indices]
+        representative_df['original_indices'] = representative_df.index.map(similar_groups)
         representative_df['representative_index'] = representative_indices
         
         logger.info(f"Repräsentativer DataFrame erstellt: {len(representative_df)} Einträge")
         
+        self.representative_df = representative_df
+        self._representative_key = representative_key
         return representative_df
     
     def map_to_ep_subheadings(self, representative_df: pd.DataFrame, ep_subheadings_path: str, 
@@ -85,56 +142,65 @@ class EPHeadingMapper:
             Dictionary mit Mapping-Ergebnissen {kundendatei_index: ep_heading_index}
         """
         logger.info("Lade EP Katalog Überschriften...")
-        df_ep = pd.read_excel(ep_subheadings_path)
+        df_ep = load_table(ep_subheadings_path)
         
-        # Nur Überschriften aus EP-Datei filtern (Art beginnt mit "NG")
-        ep_filtered = df_ep[df_ep["Art"].str.startswith("NG", na=False)]
-        ep_texts = ep_filtered["Kurztext / Bezeichnung"].dropna().astype(str).tolist()
+        # Nur Überschriften mit Text aus EP-Datei filtern (Art beginnt mit "NG")
+        is_heading = heading_mask(df_ep["Art"]) & df_ep["Kurztext / Bezeichnung"].notna().to_numpy()
+        ep_filtered = df_ep.loc[is_heading, "Kurztext / Bezeichnung"]
+        ep_texts = ep_filtered.astype(str).tolist()
         
-        # Speichere die ursprünglichen Indizes der gefilterten Zeilen
-        ep_original_indices = ep_filtered.index.tolist()
+        # Speichere die ursprünglichen Indizes der gefilterten Zeilen (gleiche Reihenfolge wie ep_texts)
+        ep_original_indices = ep_filtered.index.to_numpy()
         
         logger.info(f"EP Überschriften geladen: {len(ep_texts)} Einträge")
         
         # Spalten aus Kundendatei für den Vergleich
         kunde_spalten = ["Anlagenausprägung", "EQ-Klasse-Bezeichnung", "EQ-Bezeichnung"]
         
-        # Berechne Embeddings für EP-Überschriften
-        logger.info("Berechne Embeddings für EP-Überschriften...")
-        emb_ep = self.model.encode(ep_texts, show_progress_bar=True, device=self.device)
+        # Embeddings für EP-Überschriften (normiert -> Skalarprodukt = Cosinus-Ähnlichkeit, zwischengespeichert)
+        emb_ep = self._get_or_compute_ep_embeddings(ep_texts)
+        
+        # Sammle alle Kundendatei-Texte je Eintrag und Spalte (gleiche Texte werden nur einmal kodiert)
+        text_positions = {}
+        text_ids = np.full((len(representative_df), len(kunde_spalten)), -1)
+        for row_pos, values in enumerate(representative_df[kunde_spalten].itertuples(index=False, name=None)):
+            for column_pos, value in enumerate(values):
+                if pd.notna(value) and str(value).strip():
+                    text_ids[row_pos, column_pos] = text_positions.setdefault(str(value), len(text_positions))
+        kunde_texts = list(text_positions)
+        
+        # Berechne Embeddings aller Kundendatei-Texte in einem Aufruf und deren besten EP-Match
+        # (blockweise Matrixmultiplikation auf dem Gerät, nur der Top-1 Treffer wird zurückkopiert)
+        logger.info(f"Berechne Embeddings für {len(kunde_texts)} Kundendatei-Texte...")
+        text_best_idx = np.zeros(len(kunde_texts) + 1, dtype=np.int64)
+        text_best_score = np.zeros(len(kunde_texts) + 1, dtype=np.float32)
+        if kunde_texts:
+            with torch.inference_mode():
+                emb_kunde = self.model.encode(
+                    kunde_texts, batch_size=256, normalize_embeddings=True, convert_to_tensor=True,
+                    show_progress_bar=True, device=self.device
+                )
+                hits = util.semantic_search(emb_kunde, emb_ep, top_k=1, score_function=util.dot_score)
+            text_best_idx[:-1] = [text_hits[0]['corpus_id'] for text_hits in hits]
+            text_best_score[:-1] = [text_hits[0]['score'] for text_hits in hits]
+        
+        # Bester Match je Eintrag über alle 3 Spalten (leere Spalten zeigen auf den Score 0 am Ende,
+        # bei Gleichstand gewinnt die erste Spalte)
+        column_scores = text_best_score[text_ids]
+        best_columns = column_scores.argmax(axis=1)
+        best_text_ids = text_ids[np.arange(len(text_ids)), best_columns]
+        best_scores = text_best_score[best_text_ids]
+        best_ep_indices = text_best_idx[best_text_ids]
         
         # Mapping-Ergebnisse
         mapping_results = {}
         
         # Für jeden repräsentativen Eintrag
-        for idx, row in representative_df.iterrows():
-            best_score = 0
-            best_ep_idx = None
-            
-            # Vergleiche mit allen 3 Spalten
-            for spalte in kunde_spalten:
-                if pd.notna(row[spalte]) and str(row[spalte]).strip():
-                    kunde_text = str(row[spalte])
-                    
-                    # Berechne Embedding für diesen Text
-                    kunde_embedding = self.model.encode([kunde_text], device=self.device)
-                    
-                    # Berechne Ähnlichkeiten
-                    similarities = cosine_similarity(kunde_embedding, emb_ep)[0]
-                    
-                    # Finde besten Match
-                    max_idx = np.argmax(similarities)
-                    max_score = similarities[max_idx]
-                    
-                    # Aktualisiere besten Score
-                    if max_score > best_score:
-                        best_score = max_score
-                        best_ep_idx = max_idx
-            
+        for idx, best_score, best_ep_idx in zip(representative_df.index, best_scores, best_ep_indices):
             # Prüfe Schwellenwert
             if best_score >= similarity_threshold:
                 # Konvertiere gefilterten Index zu ursprünglichem Index
-                original_ep_idx = ep_original_indices[best_ep_idx]
+                original_ep_idx = int(ep_original_indices[best_ep_idx])
                 mapping_results[idx] = original_ep_idx
                 # Nur alle 10 Mappings loggen, um Terminal nicht zu überfluten
                 if len(mapping_results) % 10 == 0:
@@ -163,27 +229,11 @@ class EPHeadingMapper:
         """
         logger.info("Erstelle verkleinerte Kundendatei mit EP-Überschriften...")
         
-        # Lade ursprüngliche Kundendatei
-        df = pd.read_excel(kundendatei_path)
-        
-        # Erstelle DataFrame mit repräsentativen Einträgen
-        representative_indices = list(similar_groups.keys())
-        reduced_df = df.iloc[representative_indices].copy()
-        
-        # Setze den Index auf die ursprünglichen Zeilenindizes
-        reduced_df.index = representative_indices
-        
-        # Füge EP_idx Spalte hinzu
-        reduced_df['EP_idx'] = None
+        # Repräsentative Einträge (aus create_representative_dataframe wiederverwendet)
+        representative_df = self.create_representative_dataframe(kundendatei_path, similar_groups)
         
-        # Weise EP-Überschriften zu
-        for kunde_idx, ep_idx in ep_mapping.items():
-            if kunde_idx in reduced_df.index:
-                reduced_df.loc[kunde_idx, 'EP_idx'] = ep_idx
-        
-        # Füge Mapping-Informationen hinzu
-        reduced_df['original_indices'] = [similar_groups[idx] for idx in representative_indices]
-        reduced_df['representative_index'] = representative_indices
+        # Füge EP_idx Spalte hinzu (nicht gemappte Einträge bleiben leer)
+        reduced_df = representative_df.assign(EP_idx=representative_df.index.map(ep_mapping).astype('Int64'))
         
         logger.info(f"Verkleinerte Kundendatei erstellt: {len(reduced_df)} Einträge")
         logger.info(f"Davon {len(ep_mapping)} mit EP-Überschriften zugewiesen")
@@ -228,6 +278,15 @@ class EPHeadingMapper:
         stats_df.to_excel(f"{output_dir}/02_ep_mapping_statistics.xlsx", index=False)
         
         # 3. Neue Datei: EP-Mapping Ergebnisse mit visueller Gegenüberstellung
+        # Lade EP-Katalog für Überschriften einmal (Position -> Überschrift)
+        ep_heading_texts = []
+        if ep_mapping:
+            ep_df = load_table("../cvs/EP_Katalog_subheadings.xlsx")
+            if 'Kurztext / Bezeichnung' in ep_df.columns:
+                ep_heading_texts = ep_df['Kurztext / Bezeichnung'].tolist()
+            else:
+                ep_heading_texts = ['Keine Überschrift gefunden'] * len(ep_df)
+        
         ep_mapping_result_data = []
         for rep_idx in reduced_kundendatei.index:
             # Hole Kundendatei-Daten für repräsentativen Index
@@ -253,11 +312,8 @@ class EPHeadingMapper:
             ep_heading_text = ""
             if rep_idx in ep_mapping:
                 ep_idx = ep_mapping[rep_idx]
-                # Lade EP-Katalog für Überschrift
-                ep_df = pd.read_excel("../cvs/EP_Katalog_subheadings.xlsx")
-                if ep_idx < len(ep_df):
-                    ep_row = ep_df.iloc[ep_idx]
-                    ep_heading_text = ep_row.get('Kurztext / Bezeichnung', 'Keine Überschrift gefunden')
+                if ep_idx < len(ep_heading_texts):
+                    ep_heading_text = ep_heading_texts[ep_idx]
             
             ep_mapping_result_data.append({
                 'representative_index': rep_idx,
@@ -276,7 +332,8 @@ class EPHeadingMapper:
         logger.info(f"  - {len(ep_mapping)} mit EP-Überschriften gemappt")
         logger.info(f"  - {len(reduced_kundendatei) - len(ep_mapping)} für alternatives Verfahren")
 
-if __name__ == "__main__":
+def main():
+    """Hauptfunktion."""
     mapper = EPHeadingMapper()
     
     # Lade Ähnlichkeitsergebnisse aus Schritt 1
@@ -299,4 +356,7 @@ if __name__ == "__main__":
     mapper.save_ep_mapping_results(ep_mapping, reduced_kundendatei)
     
     logger.info("=== SCHRITT 2 ABGESCHLOSSEN ===")
-    logger.info("Bereit für Schritt 3: Alternative Mapping-Verfahren") 
\ No newline at end of file
+    logger.info("Bereit für Schritt 3: Alternative Mapping-Verfahren") 
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,7 @@ OpenAI API Mapping für verbleibende Einträge
 Dieses Skript:
 1. Erstellt eine Zusammenfassung der ursprünglichen Kundendatei
 2. Verwendet OpenAI API um verbleibende Einträge auf EP-Überschriften zu mappen
-3. Speichert die Ergebnisse in Kundendatei_summary.xlsx
+3. Speichert die Ergebnisse in intermediate_results/03_openai_mapping_results.parquet
 
 Autor: AI Assistant
 Datum: 2025-08-03
@@ -13,28 +13,47 @@ Datum: 2025-08-03
 
 import pandas as pd
 import numpy as np
+import asyncio
 import json
 import logging
 import os
 from pathlib import Path
-from openai import OpenAI
-from tqdm import tqdm
-import time
+from openai import AsyncOpenAI
+from sentence_transformers import SentenceTransformer, util
+import torch
+from tqdm.asyncio import tqdm_asyncio
+
+from _shared import RateLimiter, estimate_tokens, heading_mask, load_table
 
 # Logging konfigurieren
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class OpenAIMapper:
-    def __init__(self, test_limit=None):
+    def __init__(self, test_limit=None, max_concurrent_requests=20, requests_per_minute=500,
+                 tokens_per_minute=200_000, candidate_count=20,
+                 embedding_model_name='T-Systems-onsite/cross-en-de-roberta-sentence-transformer'):
         """
         Initialisiert den OpenAI Mapper.
         
         Args:
             test_limit: Begrenzung für Testläufe (None = alle Einträge)
+            max_concurrent_requests: Maximale Anzahl gleichzeitiger API Calls
+            requests_per_minute: Rate-Limit des OpenAI Kontos für Anfragen (None = unbegrenzt)
+            tokens_per_minute: Rate-Limit des OpenAI Kontos für Tokens (None = unbegrenzt)
+            candidate_count: Anzahl vorausgewählter Kategorien je Eintrag (None = alle Kategorien)
+            embedding_model_name: Sentence Transformer Modell für die Vorauswahl
         """
-        self.client = OpenAI()
+        # Der Client wiederholt Rate-Limit-Fehler (429) selbst mit exponentiellem Backoff
+        self.client = AsyncOpenAI(max_retries=6)
         self.test_limit = test_limit
+        self.max_concurrent_requests = max_concurrent_requests
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.candidate_count = candidate_count
+        self.embedding_model_name = embedding_model_name
+        self.embedder = None  # wird erst bei Bedarf geladen
+        self._lowest_headings = None
         self.intermediate_dir = Path("intermediate_results")
         self.intermediate_dir.mkdir(exist_ok=True)
         
@@ -48,13 +67,19 @@ class OpenAIMapper:
         logger.info("Lade Daten...")
         
         # Lade ursprüngliche Kundendatei
-        self.kundendatei = pd.read_excel(self.kundendatei_path)
+        self.kundendatei = load_table(self.kundendatei_path)
         logger.info(f"Kundendatei geladen: {len(self.kundendatei)} Einträge")
         
         # Lade EP Subheadings
-        self.ep_subheadings = pd.read_excel(self.ep_subheadings_path)
+        self.ep_subheadings = load_table(self.ep_subheadings_path)
         logger.info(f"EP Subheadings geladen: {len(self.ep_subheadings)} Einträge")
         
+        # Index für validate_ep_key: OZ -> erste Überschriftenzeile (Art beginnt mit "NG")
+        is_heading = heading_mask(self.ep_subheadings['Art'])
+        heading_rows = self.ep_subheadings.loc[is_heading, 'OZ'].drop_duplicates(keep='first')
+        self._oz_to_rowidx = dict(zip(heading_rows, heading_rows.index))
+        self._known_oz = set(self.ep_subheadings['OZ'].dropna())
+        
         # Lade Hierarchie
         with open(self.hierarchy_path, 'r', encoding='utf-8') as f:
             self.hierarchy = json.load(f)
@@ -67,9 +92,9 @@ class OpenAIMapper:
         """Lädt bisherige Mapping-Ergebnisse."""
         try:
             # Lade reduced Kundendatei mit EP Headings
-            reduced_path = self.intermediate_dir / "reduced_kundendatei_with_ep_headings.xlsx"
+            reduced_path = self.intermediate_dir / "reduced_kundendatei_with_ep_headings.parquet"
             if reduced_path.exists():
-                self.reduced_kundendatei = pd.read_excel(reduced_path)
+                self.reduced_kundendatei = pd.read_parquet(reduced_path)
                 logger.info(f"Reduzierte Kundendatei geladen: {len(self.reduced_kundendatei)} Einträge")
                 
                 # Finde gemappte Kunden-Indizes
@@ -85,11 +110,11 @@ class OpenAIMapper:
     
     def load_or_create_kundendatei_summary(self):
         """Lädt vorhandene oder erstellt neue Kundendatei-Zusammenfassung."""
-        summary_path = self.intermediate_dir / "03_openai_mapping_results.xlsx"
+        summary_path = self.intermediate_dir / "03_openai_mapping_results.parquet"
         
         if summary_path.exists():
             logger.info("Lade vorhandene OpenAI Mapping Ergebnisse...")
-            self.kundendatei_summary = pd.read_excel(summary_path)
+            self.kundendatei_summary = pd.read_parquet(summary_path)
             logger.info(f"OpenAI Mapping Ergebnisse geladen: {len(self.kundendatei_summary)} Einträge")
             return self.kundendatei_summary
         else:
@@ -107,106 +132,252 @@ class OpenAIMapper:
         available_columns = [col for col in self.kundendatei.columns if col not in drop_columns]
         logger.info(f"Verfügbare Spalten für Zusammenfassung: {len(available_columns)} Spalten")
         
-        # Zusammenfassung erstellen
-        summary_data = []
+        # Zellen als bereinigten Text, leere Werte (auch "nan") werden übersprungen
+        values = self.kundendatei[available_columns].astype('string').apply(lambda col: col.str.strip())
+        values = values.where((values != '') & (values != 'nan'))
         
-        for idx, row in tqdm(self.kundendatei.iterrows(), total=len(self.kundendatei), desc="Erstelle Zusammenfassungen"):
-            # Kombiniere verfügbare Spalten
-            combined_text = []
-            for col in available_columns:
-                value = row[col]
-                if pd.notna(value) and str(value).strip() != '' and str(value).strip() != 'nan':
-                    combined_text.append(str(value).strip())
-            
-            summary_text = " | ".join(combined_text) if combined_text else "Keine Beschreibung verfügbar"
-            
-            summary_data.append({
-                'Kunden_index': idx,
-                'summary_text': summary_text,
-                'original_columns': " | ".join(available_columns)
-            })
+        # Spaltenweise zusammensetzen: jedem vorhandenen Wert " | " voranstellen und am Ende entfernen
+        parts = (' | ' + values).fillna('')
+        summary_texts = parts.iloc[:, 0].str.cat(parts.iloc[:, 1:], sep='').str[len(' | '):]
+        summary_texts = summary_texts.mask(summary_texts == '', 'Keine Beschreibung verfügbar')
         
-        self.kundendatei_summary = pd.DataFrame(summary_data)
+        self.kundendatei_summary = pd.DataFrame({
+            'Kunden_index': self.kundendatei.index,
+            'summary_text': summary_texts.to_numpy(dtype=object),
+            'original_columns': " | ".join(available_columns)
+        })
         
         # Speichere Zusammenfassung
-        summary_path = self.intermediate_dir / "03_openai_mapping_results.xlsx"
-        self.kundendatei_summary.to_excel(summary_path, index=False)
+        summary_path = self.intermediate_dir / "03_openai_mapping_results.parquet"
+        self.kundendatei_summary.to_parquet(summary_path, compression='zstd')
         logger.info(f"OpenAI Mapping Ergebnisse gespeichert: {summary_path}")
         
         return self.kundendatei_summary
     
     def get_lowest_level_headings(self):
-        """Extrahiert die niedrigsten Ebenen der Hierarchie."""
+        """Extrahiert die niedrigsten Ebenen der Hierarchie (einmal pro Instanz)."""
+        if self._lowest_headings is not None:
+            return self._lowest_headings
+        
         lowest_levels = []
         
-        def find_lowest_levels(node, path=""):
-            if not node.get("children") or len(node.get("children", {})) == 0:
+        # Tiefensuche mit explizitem Stack (Reihenfolge wie bei der Rekursion, keine Rekursionstiefe)
+        stack = [(root_key, root_node) for root_key, root_node in reversed(self.hierarchy.items())]
+        while stack:
+            path, node = stack.pop()
+            children = node.get("children") or {}
+            if not children:
                 # Dies ist ein Blattknoten (niedrigste Ebene)
                 lowest_levels.append({
                     "key": path,
                     "text": node.get("text", "")
                 })
             else:
-                # Rekursiv durch Kinder gehen
-                for child_key, child_node in node["children"].items():
-                    new_path = path + child_key if path else child_key
-                    find_lowest_levels(child_node, new_path)
-        
-        # Starte mit dem Root-Knoten
-        for root_key, root_node in self.hierarchy.items():
-            find_lowest_levels(root_node, root_key)
+                # Kinder in umgekehrter Reihenfolge ablegen, damit das erste Kind zuerst verarbeitet wird
+                stack.extend(
+                    (path + child_key if path else child_key, child_node)
+                    for child_key, child_node in reversed(children.items())
+                )
         
         logger.info(f"Niedrigste Ebenen gefunden: {len(lowest_levels)}")
         if len(lowest_levels) <= 5:  # Debug: Zeige erste paar Einträge
             for i, level in enumerate(lowest_levels[:5]):
                 logger.info(f"  {i+1}. {level['key']}: {level['text'][:50]}...")
+        
+        self._lowest_headings = lowest_levels
         return lowest_levels
     
-    def create_openai_prompt(self, summary_text, lowest_headings):
-        """Erstellt den OpenAI Prompt für das Mapping."""
-        # Erstelle Liste der verfügbaren Überschriften (alle Kategorien)
-        headings_text = "\n".join([f"{h['key']}: {h['text']}" for h in lowest_headings])
+    def select_candidate_headings(self, summary_texts, lowest_headings):
+        """
+        Wählt je Eintrag die ähnlichsten Kategorien per Sentence Transformer vor.
+        
+        Das Modell bekommt so nur die candidate_count ähnlichsten statt aller Kategorien
+        zu sehen (deutlich weniger Input-Tokens und weniger unpassende Kategorien).
         
-        prompt = f"""
+        Args:
+            summary_texts: Liste der Zusammenfassungstexte
+            lowest_headings: Liste der niedrigsten Hierarchie-Ebenen
+            
+        Returns:
+            Liste mit den Kandidaten-Kategorien je Zusammenfassungstext (ähnlichste zuerst)
+        """
+        if not summary_texts or not self.candidate_count or self.candidate_count >= len(lowest_headings):
+            return [lowest_headings] * len(summary_texts)
+        
+        if self.embedder is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+            self.embedder = SentenceTransformer(self.embedding_model_name, device=device)
+            logger.info(f"Verwende Modell für Vorauswahl: {self.embedding_model_name} auf {device}")
+        
+        logger.info(f"Wähle je Eintrag {self.candidate_count} Kategorien vor...")
+        with torch.inference_mode():
+            emb_headings = self.embedder.encode(
+                [h['text'] for h in lowest_headings], batch_size=256, normalize_embeddings=True,
+                convert_to_tensor=True
+            )
+            emb_summaries = self.embedder.encode(
+                summary_texts, batch_size=256, normalize_embeddings=True, convert_to_tensor=True,
+                show_progress_bar=True
+            )
+            hits = util.semantic_search(emb_summaries, emb_headings, top_k=self.candidate_count,
+                                        score_function=util.dot_score)
+        
+        return [[lowest_headings[hit['corpus_id']] for hit in entry_hits] for entry_hits in hits]
+    
+    def create_system_prompt(self):
+        """
+        Erstellt den System Prompt (für alle Einträge identisch, wird einmal pro Lauf erstellt).
+        """
+        return """
 Du bist ein Experte für die Zuordnung von technischen Anlagen zu Kategorien.
 
-Gegeben ist folgende Beschreibung einer technischen Anlage:
-{summary_text}
-
-Verfügbare Kategorien (nur die niedrigste Ebene):
-{headings_text}
-
 Aufgabe: Finde die am besten passende Kategorie für die beschriebene Anlage.
 
 Wichtige Regeln:
 1. Wähle nur aus den angegebenen Kategorien
-2. Gib NUR den Schlüssel (z.B. "01.01.01.12.") zurück
+2. Gib den Schlüssel (z.B. "01.01.01.12.") im Feld "ep_key" zurück
 3. Keine Erklärungen oder zusätzlichen Text
 4. Wenn keine passende Kategorie gefunden wird, gib "KEINE_PASSENDE_KATEGORIE" zurück
+"""
+    
+    def create_openai_prompt(self, summary_text, candidate_headings):
+        """Erstellt den OpenAI Prompt (User-Nachricht) für einen Eintrag."""
+        # Erstelle Liste der vorausgewählten Überschriften
+        headings_text = "\n".join([f"{h['key']}: {h['text']}" for h in candidate_headings])
+        
+        return f"""
+Gegeben ist folgende Beschreibung einer technischen Anlage:
+{summary_text}
 
-Antwort (nur der Schlüssel):
+Verfügbare Kategorien (nur die niedrigste Ebene):
+{headings_text}
 """
-        return prompt
+    
+    def create_response_format(self, lowest_headings):
+        """
+        Erstellt das JSON-Schema für die Antwort (Structured Outputs).
+        
+        Das Feld "ep_key" ist auf die Schlüssel der niedrigsten Ebenen beschränkt,
+        das Modell kann also keine unbekannten Schlüssel oder Freitext zurückgeben.
+        """
+        valid_keys = [h['key'] for h in lowest_headings] + ["KEINE_PASSENDE_KATEGORIE"]
+        
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "ep_mapping",
+                "strict": True,
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "ep_key": {"type": "string", "enum": valid_keys}
+                    },
+                    "required": ["ep_key"],
+                    "additionalProperties": False
+                }
+            }
+        }
     
     def validate_ep_key(self, key):
         """Validiert einen EP-Schlüssel gegen die EP_Katalog_subheadings.xlsx."""
         if key == "KEINE_PASSENDE_KATEGORIE":
             return False, None
         
-        # Suche nach dem Schlüssel in der OZ-Spalte
-        matching_rows = self.ep_subheadings[self.ep_subheadings['OZ'] == key]
+        # Überschriftenzeile mit diesem Schlüssel nachschlagen
+        row_index = self._oz_to_rowidx.get(key)
+        if row_index is not None:
+            return True, row_index  # Gib den ursprünglichen Index zurück
         
-        if len(matching_rows) == 0:
+        if key not in self._known_oz:
             logger.warning(f"Schlüssel {key} nicht in EP_Katalog_subheadings gefunden")
-            return False, None
+        else:
+            logger.warning(f"Schlüssel {key} gefunden, aber keine Überschriftenzeile (Art nicht NG)")
+        return False, None
+    
+    async def _map_entry(self, semaphore, rate_limiter, kunden_index, summary_text, candidate_headings,
+                         system_prompt, response_format):
+        """
+        Mapped einen einzelnen Eintrag mit der OpenAI API.
         
-        # Prüfe ob es eine Überschriftenzeile ist (Art beginnt mit "NG")
-        for _, row in matching_rows.iterrows():
-            if pd.notna(row['Art']) and str(row['Art']).startswith('NG'):
-                return True, row.name  # Gib den ursprünglichen Index zurück
+        Args:
+            semaphore: Begrenzt die Anzahl gleichzeitiger API Calls
+            rate_limiter: Hält die Anfragen und Tokens pro Minute ein (siehe RateLimiter)
+            kunden_index: Index des Eintrags in der Kundendatei
+            summary_text: Zusammenfassungstext des Eintrags
+            candidate_headings: Vorausgewählte Kategorien (siehe select_candidate_headings)
+            system_prompt: System Prompt (siehe create_system_prompt)
+            response_format: JSON-Schema der Antwort (siehe create_response_format)
+            
+        Returns:
+            Dictionary mit dem Mapping-Ergebnis
+        """
+        try:
+            # Erstelle OpenAI Prompt
+            prompt = self.create_openai_prompt(summary_text, candidate_headings)
+            
+            # OpenAI API Call
+            async with semaphore:
+                await rate_limiter.acquire(estimate_tokens(system_prompt + prompt) + 50)
+                response = await self.client.chat.completions.create(
+                    model="gpt-4o-mini",
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": prompt}
+                    ],
+                    response_format=response_format,
+                    temperature=0.0,
+                    max_tokens=50
+                )
+            
+            # Extrahiere Antwort ({"ep_key": "..."})
+            response_text = json.loads(response.choices[0].message.content)["ep_key"]
+            
+            # Validiere Antwort
+            is_valid, ep_original_index = self.validate_ep_key(response_text)
+            
+            return {
+                'Kunden_index': kunden_index,
+                'summary_text': summary_text,
+                'openai_response': response_text,
+                'is_valid_mapping': is_valid,
+                'EP_original_index': ep_original_index,
+                'EP_key': response_text if is_valid else None
+            }
+            
+        except Exception as e:
+            logger.error(f"Fehler beim Mapping von Kunden_index {kunden_index}: {e}")
+            return {
+                'Kunden_index': kunden_index,
+                'summary_text': summary_text,
+                'openai_response': f"Fehler: {str(e)}",
+                'is_valid_mapping': False,
+                'EP_original_index': None,
+                'EP_key': None
+            }
+    
+    async def _map_entries(self, entries, lowest_headings):
+        """
+        Mapped alle Einträge parallel mit der OpenAI API.
         
-        logger.warning(f"Schlüssel {key} gefunden, aber keine Überschriftenzeile (Art nicht NG)")
-        return False, None
+        Args:
+            entries: Liste von (kunden_index, summary_text) Tupeln
+            lowest_headings: Liste der niedrigsten Hierarchie-Ebenen
+            
+        Returns:
+            Liste der Mapping-Ergebnisse (in der Reihenfolge von entries)
+        """
+        candidates = self.select_candidate_headings([summary_text for _, summary_text in entries], lowest_headings)
+        
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        rate_limiter = RateLimiter(self.requests_per_minute, self.tokens_per_minute)
+        system_prompt = self.create_system_prompt()
+        response_format = self.create_response_format(lowest_headings)
+        tasks = [
+            self._map_entry(semaphore, rate_limiter, kunden_index, summary_text, candidate_headings,
+                            system_prompt, response_format)
+            for (kunden_index, summary_text), candidate_headings in zip(entries, candidates)
+        ]
+        return await tqdm_asyncio.gather(*tasks, desc="OpenAI Mapping")
     
     def map_unmapped_entries(self):
         """Mapped verbleibende Einträge mit OpenAI API."""
@@ -226,67 +397,26 @@ Antwort (nur der Schlüssel):
         # Hole niedrigste Ebenen der Hierarchie
         lowest_headings = self.get_lowest_level_headings()
         
-        # Mapping-Ergebnisse
-        mapping_results = []
+        # Zusammenfassungen einmal indizieren statt pro Eintrag zu filtern
+        summary_by_index = dict(zip(self.kundendatei_summary['Kunden_index'], self.kundendatei_summary['summary_text']))
         
-        for kunden_index in tqdm(unmapped_indices, desc="OpenAI Mapping"):
-            try:
-                # Hole Zusammenfassung für diesen Eintrag
-                summary_row = self.kundendatei_summary[self.kundendatei_summary['Kunden_index'] == kunden_index]
-                if len(summary_row) == 0:
-                    logger.warning(f"Keine Zusammenfassung gefunden für Kunden_index {kunden_index}")
-                    continue
-                
-                summary_text = summary_row.iloc[0]['summary_text']
-                
-                # Erstelle OpenAI Prompt
-                prompt = self.create_openai_prompt(summary_text, lowest_headings)
-                
-                # OpenAI API Call
-                response = self.client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[
-                        {"role": "system", "content": "Du bist ein Experte für technische Kategorisierung."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.0,
-                    max_tokens=50
-                )
-                
-                # Extrahiere Antwort
-                response_text = response.choices[0].message.content.strip()
-                
-                # Validiere Antwort
-                is_valid, ep_original_index = self.validate_ep_key(response_text)
-                
-                mapping_results.append({
-                    'Kunden_index': kunden_index,
-                    'summary_text': summary_text,
-                    'openai_response': response_text,
-                    'is_valid_mapping': is_valid,
-                    'EP_original_index': ep_original_index,
-                    'EP_key': response_text if is_valid else None
-                })
-                
-                # Längere Pause zwischen API Calls um Rate Limiting zu vermeiden
-                time.sleep(2.0)
-                
-            except Exception as e:
-                logger.error(f"Fehler beim Mapping von Kunden_index {kunden_index}: {e}")
-                mapping_results.append({
-                    'Kunden_index': kunden_index,
-                    'summary_text': summary_text if 'summary_text' in locals() else "Fehler beim Laden",
-                    'openai_response': f"Fehler: {str(e)}",
-                    'is_valid_mapping': False,
-                    'EP_original_index': None,
-                    'EP_key': None
-                })
+        entries = []
+        for kunden_index in unmapped_indices:
+            if kunden_index not in summary_by_index:
+                logger.warning(f"Keine Zusammenfassung gefunden für Kunden_index {kunden_index}")
+                continue
+            entries.append((kunden_index, summary_by_index[kunden_index]))
+        
+        # API Calls parallel ausführen (begrenzt durch max_concurrent_requests)
+        mapping_results = asyncio.run(self._map_entries(entries, lowest_headings))
         
-        # Erstelle DataFrame und speichere
-        self.mapping_results_df = pd.DataFrame(mapping_results)
+        # Erstelle DataFrame und speichere (Parquet speichert den nullable Index-Typ direkt)
+        self.mapping_results_df = pd.DataFrame(mapping_results, columns=[
+            'Kunden_index', 'summary_text', 'openai_response', 'is_valid_mapping', 'EP_original_index', 'EP_key'
+        ]).astype({'EP_original_index': 'Int64'})
         
-        results_path = self.intermediate_dir / "openai_mapping_results.xlsx"
-        self.mapping_results_df.to_excel(results_path, index=False)
+        results_path = self.intermediate_dir / "openai_mapping_results.parquet"
+        self.mapping_results_df.to_parquet(results_path, compression='zstd')
         logger.info(f"OpenAI Mapping-Ergebnisse gespeichert: {results_path}")
         
         # Statistiken
@@ -299,16 +429,21 @@ Antwort (nur der Schlüssel):
         """Aktualisiert die Kundendatei-Zusammenfassung mit den neuen Mappings."""
         logger.info("Aktualisiere Kundendatei-Zusammenfassung mit neuen Mappings...")
         
-        # Füge Mapping-Ergebnisse hinzu
-        self.kundendatei_summary = self.kundendatei_summary.merge(
-            self.mapping_results_df[['Kunden_index', 'openai_response', 'is_valid_mapping', 'EP_original_index', 'EP_key']],
-            on='Kunden_index',
-            how='left'
-        )
+        result_columns = ['openai_response', 'is_valid_mapping', 'EP_original_index', 'EP_key']
+        summary = self.kundendatei_summary.set_index('Kunden_index')
+        new_results = self.mapping_results_df.set_index('Kunden_index')[result_columns]
+        
+        # Ergebnisse eines früheren Laufs bleiben erhalten, neue Ergebnisse überschreiben sie
+        if summary.columns.isin(result_columns).any():
+            new_results = new_results.combine_first(summary[summary.columns.intersection(result_columns)])[result_columns]
+            summary = summary.drop(columns=result_columns, errors='ignore')
+        
+        # Füge Mapping-Ergebnisse hinzu (Kunden_index ist auf beiden Seiten eindeutig)
+        self.kundendatei_summary = summary.join(new_results, how='left', validate='one_to_one').reset_index()
         
         # Speichere aktualisierte Zusammenfassung
-        summary_path = self.intermediate_dir / "03_openai_mapping_results.xlsx"
-        self.kundendatei_summary.to_excel(summary_path, index=False)
+        summary_path = self.intermediate_dir / "03_openai_mapping_results.parquet"
+        self.kundendatei_summary.to_parquet(summary_path, compression='zstd')
         logger.info(f"Aktualisierte OpenAI Mapping Ergebnisse gespeichert: {summary_path}")
         
         return self.kundendatei_summary
@@ -14,21 +14,55 @@ Datum: 2025-08-03
 
 import pandas as pd
 import numpy as np
+import asyncio
+import hashlib
 import json
 import logging
 import os
-import time
+import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from openai import OpenAI
+from openai import AsyncOpenAI
+from sentence_transformers import SentenceTransformer
+import torch
 from tqdm import tqdm
+from tqdm.asyncio import tqdm_asyncio
+
+from _shared import RateLimiter, estimate_tokens, heading_mask, load_table, write_csv
 
 # Logging konfigurieren
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class ArticleNumberMapper:
-    def __init__(self):
-        """Initialisiert den Article Number Mapper."""
+    # Artikelnummer-ähnliche Tokens im Kundentext (z.B. "334.01.01.000.01.00")
+    ARTICLE_NUMBER_PATTERN = re.compile(r'\b[0-9A-Z][0-9A-Z.\-/]{2,}[0-9A-Z]\b')
+    
+    # Beschreibende Spalten des EP-Katalogs (der EP-Katalog führt die Bezeichnung als "Kurztext / Bezeichnung")
+    DESCRIPTION_COLUMNS = ['Bezeichnung', 'Kurztext / Bezeichnung', 'Beschreibung', 'Spezifikation', 'Hersteller']
+    
+    def __init__(self, max_concurrent_requests=20, requests_per_minute=500, tokens_per_minute=200_000,
+                 batch_size=20, duplicate_threshold=0.95, ranking_margin=0.05, ranking_min_score=0.6,
+                 candidate_count=15, candidate_margin=0.02,
+                 embedding_model_name='T-Systems-onsite/cross-en-de-roberta-sentence-transformer'):
+        """
+        Initialisiert den Article Number Mapper.
+        
+        Args:
+            max_concurrent_requests: Maximale Anzahl gleichzeitiger API Calls
+            requests_per_minute: Rate-Limit des OpenAI Kontos für Anfragen (None = unbegrenzt)
+            tokens_per_minute: Rate-Limit des OpenAI Kontos für Tokens (None = unbegrenzt)
+            batch_size: Maximale Anzahl Kundeneinträge derselben EP-Gruppe pro API Call
+            duplicate_threshold: Ab dieser Cosinus-Ähnlichkeit übernehmen Einträge derselben
+                EP-Gruppe die Antwort eines bereits abgefragten Eintrags (None = aus)
+            ranking_margin: Mindestabstand zwischen bestem und zweitbestem Artikel (Cosinus-Ähnlichkeit),
+                ab dem der beste Artikel ohne OpenAI API Call übernommen wird (None = aus)
+            ranking_min_score: Mindest-Cosinus-Ähnlichkeit des besten Artikels für die Übernahme ohne API Call
+            candidate_count: Anzahl ähnlichster Artikel je Eintrag, die im Prompt stehen (None = alle)
+            candidate_margin: Mindestabstand (Cosinus-Ähnlichkeit) zwischen dem letzten übernommenen und dem
+                ersten weggelassenen Artikel - bei kleinerem Abstand steht die ganze EP-Gruppe im Prompt
+            embedding_model_name: Sentence Transformer Modell für Ähnlichkeitsvergleich und Ranking
+        """
         self.intermediate_dir = Path("intermediate_results")
         self.intermediate_dir.mkdir(exist_ok=True)
         
@@ -38,24 +72,51 @@ class ArticleNumberMapper:
         self.ep_subheadings_path = "../cvs/EP_Katalog_subheadings.xlsx"
         
         # OpenAI Client für Artikelnummer-Vergleich
-        self.client = OpenAI()
+        # (wiederholt Rate-Limit-Fehler (429) selbst mit exponentiellem Backoff)
+        self.client = AsyncOpenAI(max_retries=6)
+        self.max_concurrent_requests = max_concurrent_requests
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.batch_size = batch_size
+        self.duplicate_threshold = duplicate_threshold
+        self.ranking_margin = ranking_margin
+        self.ranking_min_score = ranking_min_score
+        self.candidate_count = candidate_count
+        self.candidate_margin = candidate_margin
+        self.embedding_model_name = embedding_model_name
+        self.embedder = None  # wird erst bei Bedarf geladen
+        self._group_embeddings = {}  # ep_index -> Embeddings der Artikel-Vergleichstexte
+        self._group_article_rows = {}  # ep_index -> {Artikelnummer: Katalog-Index}
+        
+        # Antworten der OpenAI API bleiben zwischen Läufen erhalten (Schlüssel: SHA-256 des Prompts)
+        self.response_cache_path = self.intermediate_dir / "04_openai_response_cache.json"
+        self.response_cache = {}
         
     def load_data(self):
         """Lädt alle benötigten Daten."""
         logger.info("Lade Daten...")
         
-        # Lade ursprüngliche Kundendatei
-        self.kundendatei = pd.read_excel(self.kundendatei_path)
-        logger.info(f"Kundendatei geladen: {len(self.kundendatei)} Einträge")
+        # Lade Kundendatei, EP Katalog und EP Subheadings parallel (voneinander unabhängig)
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            kundendatei_future = executor.submit(load_table, self.kundendatei_path)
+            ep_katalog_future = executor.submit(load_table, self.ep_katalog_path)
+            ep_subheadings_future = executor.submit(load_table, self.ep_subheadings_path)
+            
+            self.kundendatei = kundendatei_future.result()
+            self.ep_katalog = ep_katalog_future.result()
+            self.ep_subheadings = ep_subheadings_future.result()
         
-        # Lade EP Katalog
-        self.ep_katalog = pd.read_excel(self.ep_katalog_path)
+        logger.info(f"Kundendatei geladen: {len(self.kundendatei)} Einträge")
         logger.info(f"EP Katalog geladen: {len(self.ep_katalog)} Einträge")
-        
-        # Lade EP Subheadings
-        self.ep_subheadings = pd.read_excel(self.ep_subheadings_path)
         logger.info(f"EP Subheadings geladen: {len(self.ep_subheadings)} Einträge")
         
+        # Positionen aller Überschriften (Art beginnt mit "NG") - begrenzen die EP-Gruppen
+        self.heading_positions = np.flatnonzero(heading_mask(self.ep_katalog['Art']))
+        
+        # Vergleichstexte der Artikel einmalig erstellen (statt pro Kundeneintrag)
+        self.ep_katalog['comparison_text'] = self.create_article_comparison_texts(self.ep_katalog)
+        self.ep_katalog['has_description'] = self.find_described_articles(self.ep_katalog)
+        
         # Lade bisherige Ergebnisse
         self.load_previous_results()
         
@@ -63,9 +124,11 @@ class ArticleNumberMapper:
         """Lädt bisherige Mapping-Ergebnisse."""
         try:
             # Lade Kundendatei-Zusammenfassung mit OpenAI Mappings
-            summary_path = self.intermediate_dir / "03_openai_mapping_results.xlsx"
+            summary_path = self.intermediate_dir / "03_openai_mapping_results.parquet"
             if summary_path.exists():
-                self.kundendatei_summary = pd.read_excel(summary_path)
+                self.kundendatei_summary = pd.read_parquet(
+                    summary_path, columns=['Kunden_index', 'summary_text', 'EP_original_index']
+                )
                 logger.info(f"Kundendatei-Zusammenfassung geladen: {len(self.kundendatei_summary)} Einträge")
             else:
                 raise FileNotFoundError("Kundendatei-Zusammenfassung nicht gefunden")
@@ -79,6 +142,12 @@ class ArticleNumberMapper:
             else:
                 self.similar_groups = {}
                 logger.warning("Keine Similarity Groups gefunden")
+            
+            # Lade gespeicherte OpenAI Antworten
+            if self.response_cache_path.exists():
+                with open(self.response_cache_path, 'r', encoding='utf-8') as f:
+                    self.response_cache = json.load(f)
+                logger.info(f"OpenAI Antwort-Cache geladen: {len(self.response_cache)} Antworten")
                 
         except Exception as e:
             logger.error(f"Fehler beim Laden bisheriger Ergebnisse: {e}")
@@ -103,137 +172,483 @@ class ArticleNumberMapper:
             return pd.DataFrame()
         
         # Gehe zum nächsten Index (erster Artikel der Gruppe)
-        start_index = ep_original_index + 1
-        
-        # Sammle alle Zeilen bis zur nächsten Überschrift
-        group_rows = []
-        current_index = start_index
+        start_index = int(ep_original_index) + 1
         
-        while current_index < len(self.ep_katalog):
-            row = self.ep_katalog.iloc[current_index]
-            
-            # Prüfe ob es eine Überschrift ist (Art beginnt mit "NG")
-            if pd.notna(row.get('Art', '')) and str(row['Art']).startswith('NG'):
-                # Neue Überschrift gefunden - Gruppe ist vollständig
-                break
-            
-            # Füge Artikel zur Gruppe hinzu
-            group_rows.append(row)
-            current_index += 1
+        # Gruppe endet vor der nächsten Überschrift (oder am Ende des Katalogs)
+        next_heading = np.searchsorted(self.heading_positions, start_index)
+        if next_heading < len(self.heading_positions):
+            end_index = int(self.heading_positions[next_heading])
+        else:
+            end_index = len(self.ep_katalog)
         
-        if group_rows:
-            group_df = pd.DataFrame(group_rows)
+        if end_index > start_index:
+            # Slice ohne Kopie - die Gruppe wird nachfolgend nur gelesen
+            group_df = self.ep_katalog.iloc[start_index:end_index]
             logger.info(f"EP-Gruppe extrahiert: {len(group_df)} Artikel (Start: {start_index})")
             return group_df
         else:
             logger.warning(f"Keine Artikel in EP-Gruppe gefunden für Index {ep_original_index}")
             return pd.DataFrame()
     
-    def create_article_comparison_text(self, article_row):
+    def create_article_comparison_texts(self, ep_katalog):
         """
-        Erstellt einen Vergleichstext für einen Artikel aus dem EP-Katalog.
+        Erstellt die Vergleichstexte aller Artikel des EP-Katalogs.
         
         Args:
-            article_row: Zeile aus dem EP-Katalog
+            ep_katalog: DataFrame mit dem EP-Katalog
             
         Returns:
-            String mit relevanten Informationen des Artikels
+            Series mit relevanten Informationen je Artikel (gleicher Index wie ep_katalog)
         """
         # Wichtige Spalten für den Vergleich
-        important_columns = ['Bezeichnung', 'Beschreibung', 'Spezifikation', 'Hersteller', 'Artikelnummer']
+        important_columns = self.DESCRIPTION_COLUMNS + ['Artikelnummer']
+        available_columns = [col for col in important_columns if col in ep_katalog.columns]
+        
+        comparison_texts = pd.Series('', index=ep_katalog.index, dtype='string')
+        for col in available_columns:
+            # Zellen als bereinigten Text, leere Werte (auch "nan") werden übersprungen
+            values = ep_katalog[col].astype('string').str.strip()
+            values = values.where((values != '') & (values != 'nan'))
+            comparison_texts = comparison_texts + (' | ' + values).fillna('')
+        
+        comparison_texts = comparison_texts.str[len(' | '):]
+        return comparison_texts.mask(comparison_texts == '', 'Keine Beschreibung verfügbar')
+    
+    def find_described_articles(self, ep_katalog):
+        """
+        Markiert die Artikel, deren Vergleichstext mehr als die Artikelnummer enthält.
         
-        comparison_parts = []
-        for col in important_columns:
-            if col in article_row.index and pd.notna(article_row[col]):
-                value = str(article_row[col]).strip()
-                if value and value != 'nan':
-                    comparison_parts.append(value)
+        Nur für diese Artikel sagt die Embedding-Ähnlichkeit zur Zusammenfassung etwas aus.
         
-        return " | ".join(comparison_parts) if comparison_parts else "Keine Beschreibung verfügbar"
+        Args:
+            ep_katalog: DataFrame mit dem EP-Katalog
+            
+        Returns:
+            Boolean-Series (gleicher Index wie ep_katalog)
+        """
+        described = pd.Series(False, index=ep_katalog.index)
+        for col in self.DESCRIPTION_COLUMNS:
+            if col not in ep_katalog.columns:
+                continue
+            values = ep_katalog[col].astype('string').str.strip()
+            described |= ((values != '') & (values != 'nan')).fillna(False).astype(bool)
+        return described
     
-    def create_openai_prompt(self, customer_summary, ep_group_df):
+    def create_openai_prompt(self, customer_entries, ep_group_df):
         """
-        Erstellt einen OpenAI Prompt für den Artikelnummer-Vergleich.
+        Erstellt einen OpenAI Prompt für den Artikelnummer-Vergleich mehrerer Kundeneinträge.
         
         Args:
-            customer_summary: Zusammenfassungstext der Kundendatei
+            customer_entries: Liste von (kunden_index, customer_summary) Tupeln derselben EP-Gruppe
             ep_group_df: DataFrame mit EP-Gruppe
             
         Returns:
             String mit dem OpenAI Prompt
         """
-        # Erstelle Artikel-Liste für den Prompt
-        articles_text = ""
-        for idx, row in ep_group_df.iterrows():
-            article_text = self.create_article_comparison_text(row)
-            articles_text += f"Artikel {idx}: {article_text}\n"
+        # Erstelle Artikel-Liste für den Prompt (Vergleichstexte aus load_data)
+        articles_text = "".join(
+            f"Artikel {idx}: {article_text}\n"
+            for idx, article_text in zip(ep_group_df.index, ep_group_df['comparison_text'])
+        )
+        
+        # Erstelle Liste der Kundeneinträge (Schlüssel = Kunden_index)
+        customer_text = "\n".join(
+            f"{kunden_index}: {customer_summary}" for kunden_index, customer_summary in customer_entries
+        )
         
         prompt = f"""
 Du bist ein Experte für die Zuordnung von Kundeneinträgen zu Artikelnummern.
 
-KUNDENEINTRAG:
-{customer_summary}
+KUNDENEINTRÄGE:
+{customer_text}
 
 VERFÜGBARE ARTIKEL:
 {articles_text}
 
 AUFGABE:
-Finde die beste Übereinstimmung zwischen dem Kundeneintrag und einem der verfügbaren Artikel.
+Finde für jeden Kundeneintrag die beste Übereinstimmung mit einem der verfügbaren Artikel.
 Berücksichtige dabei Bezeichnung, Beschreibung, Spezifikation und Hersteller.
 
 ANTWORT:
-Gib NUR die Artikelnummer des besten Matches zurück. Falls kein passender Artikel gefunden wird, antworte mit "KEIN_MATCH".
-
-Artikelnummer: """
+Gib NUR ein JSON-Objekt zurück, das jedem Kundeneintrag (Schlüssel vor dem Doppelpunkt) die Artikelnummer
+des besten Matches zuordnet. Falls kein passender Artikel gefunden wird, verwende "KEIN_MATCH".
+Beispiel: {{"123": "334.01.01.000.01.00", "124": "KEIN_MATCH"}}
+"""
         
         return prompt
     
-    def find_best_article_match(self, customer_summary, ep_group_df):
+    def create_response_format(self, customer_entries, ep_group_df):
+        """
+        Erstellt das JSON-Schema für die Antwort (Structured Outputs).
+        
+        Jeder Kundeneintrag des Batches ist ein Pflichtfeld, dessen Wert auf die Artikelnummern
+        im Prompt (oder "KEIN_MATCH") beschränkt ist - das Modell kann also keine unbekannten
+        Artikelnummern oder Freitext zurückgeben.
+        """
+        valid_article_numbers = list(dict.fromkeys(ep_group_df['Artikelnummer'].dropna().astype(str))) + ["KEIN_MATCH"]
+        keys = [str(kunden_index) for kunden_index, _ in customer_entries]
+        
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "article_mapping",
+                "strict": True,
+                "schema": {
+                    "type": "object",
+                    "properties": {key: {"type": "string", "enum": valid_article_numbers} for key in keys},
+                    "required": keys,
+                    "additionalProperties": False
+                }
+            }
+        }
+    
+    def find_exact_article_match(self, customer_summary, ep_group_df, article_rows, article_names):
         """
-        Findet den besten Artikel-Match für eine Kundendatei-Zusammenfassung mit OpenAI.
+        Sucht einen eindeutigen lexikalischen Treffer ohne OpenAI API Call.
+        
+        Treffer ist entweder eine im Kundentext genannte Artikelnummer der Gruppe oder eine
+        Artikelbezeichnung der Gruppe, die wörtlich im Kundentext vorkommt.
         
         Args:
             customer_summary: Zusammenfassungstext der Kundendatei
             ep_group_df: DataFrame mit EP-Gruppe
+            article_rows: Dictionary {Artikelnummer: Katalog-Index} der EP-Gruppe
+            article_names: Dictionary {Spalte: bereinigte Artikelbezeichnungen} der EP-Gruppe
             
         Returns:
-            Tuple (best_match_row, article_number)
+            Artikelnummer des eindeutigen Treffers oder None
         """
+        if pd.isna(customer_summary):
+            return None
+        customer_summary = str(customer_summary)
+        
+        # Im Kundentext genannte Artikelnummern
+        hits = set(self.ARTICLE_NUMBER_PATTERN.findall(customer_summary)) & article_rows.keys()
+        if len(hits) == 1:
+            return hits.pop()
+        if hits:
+            return None
+        
+        # Wörtlich im Kundentext enthaltene Artikelbezeichnung
+        for names in article_names.values():
+            contained = [idx for idx, name in names.items() if name in customer_summary]
+            matches = ep_group_df.loc[contained, 'Artikelnummer'].dropna().astype(str).unique()
+            if len(matches) == 1:
+                return matches[0]
+        
+        return None
+    
+    async def find_best_article_matches(self, ep_index, customer_entries, ep_group_df, rate_limiter=None):
+        """
+        Findet die besten Artikel-Matches für mehrere Kundendatei-Zusammenfassungen
+        derselben EP-Gruppe mit einem OpenAI API Call.
+        
+        Args:
+            ep_index: Index der EP-Überschrift
+            customer_entries: Liste von (kunden_index, customer_summary) Tupeln
+            ep_group_df: DataFrame mit EP-Gruppe (oder den Kandidaten daraus)
+            rate_limiter: Hält die Anfragen und Tokens pro Minute ein (None = keine Begrenzung)
+            
+        Returns:
+            Dictionary {kunden_index: article_number} (None = kein Match)
+        """
+        article_matches = {kunden_index: None for kunden_index, _ in customer_entries}
         if len(ep_group_df) == 0:
-            return None, None
+            return article_matches
         
         try:
             # Erstelle OpenAI Prompt
-            prompt = self.create_openai_prompt(customer_summary, ep_group_df)
-            
-            # OpenAI API Call
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=50,
-                temperature=0.1
-            )
+            model = "gpt-4o-mini"
+            prompt = self.create_openai_prompt(customer_entries, ep_group_df)
+            cache_key = hashlib.sha256(f"{model}\n{prompt}".encode('utf-8')).hexdigest()
             
-            # Extrahiere Antwort
-            article_number = response.choices[0].message.content.strip()
+            if cache_key in self.response_cache:
+                # Gleicher Prompt wurde bereits beantwortet (z.B. in einem abgebrochenen Lauf)
+                answers = self.response_cache[cache_key]
+            else:
+                # Antwort ist durch das Schema auf Schlüssel und Artikelnummer begrenzt
+                max_tokens = 30 * len(customer_entries)
+                if rate_limiter is not None:
+                    await rate_limiter.acquire(estimate_tokens(prompt) + max_tokens)
+                
+                # OpenAI API Call
+                response = await self.client.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {"role": "user", "content": prompt}
+                    ],
+                    response_format=self.create_response_format(customer_entries, ep_group_df),
+                    max_tokens=max_tokens,
+                    temperature=0.0
+                )
+                
+                # Extrahiere Antworten
+                answers = json.loads(response.choices[0].message.content)
+                self.response_cache[cache_key] = answers
             
-            # Prüfe ob ein Match gefunden wurde
-            if article_number == "KEIN_MATCH" or not article_number:
-                return None, None
+            article_rows = self._group_article_rows[ep_index]
             
-            # Finde die entsprechende Zeile im DataFrame
-            matching_row = ep_group_df[ep_group_df['Artikelnummer'] == article_number]
-            if len(matching_row) > 0:
-                return matching_row.iloc[0], article_number
-            else:
-                logger.warning(f"Artikelnummer {article_number} nicht in EP-Gruppe gefunden")
-                return None, None
+            for kunden_index, _ in customer_entries:
+                article_number = str(answers.get(str(kunden_index)) or "").strip()
+                
+                # Prüfe ob ein Match gefunden wurde
+                if article_number == "KEIN_MATCH" or not article_number:
+                    continue
+                
+                # Prüfe ob die Artikelnummer zur EP-Gruppe gehört
+                if article_number in article_rows:
+                    article_matches[kunden_index] = article_number
+                else:
+                    logger.warning(f"Artikelnummer {article_number} nicht in EP-Gruppe gefunden")
+            
+            return article_matches
                 
         except Exception as e:
             logger.error(f"Fehler beim OpenAI API Call: {e}")
-            return None, None
+            return article_matches
+    
+    def encode_texts(self, texts):
+        """
+        Berechnet normierte Embeddings (gleiche Texte werden nur einmal kodiert).
+        
+        Args:
+            texts: Liste von Texten
+            
+        Returns:
+            NumPy-Array mit einem normierten Embedding pro Text
+        """
+        if self.embedder is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+            self.embedder = SentenceTransformer(self.embedding_model_name, device=device)
+            logger.info(f"Verwende Modell für Ähnlichkeitsvergleich: {self.embedding_model_name} auf {device}")
+        
+        unique_texts = list(dict.fromkeys(texts))
+        with torch.inference_mode():
+            unique_embeddings = self.embedder.encode(
+                unique_texts, batch_size=256, normalize_embeddings=True, convert_to_numpy=True,
+                show_progress_bar=len(unique_texts) > 256
+            )
+        text_positions = {text: position for position, text in enumerate(unique_texts)}
+        return unique_embeddings[[text_positions[text] for text in texts]]
+    
+    def find_duplicate_entries(self, entries, embeddings=None):
+        """
+        Bestimmt für jeden Eintrag, welcher Eintrag stellvertretend abgefragt wird.
+        
+        Innerhalb derselben EP-Gruppe teilen sich Einträge eine Anfrage, wenn sie zur selben
+        Ähnlichkeitsgruppe aus Schritt 1 gehören oder ihre Zusammenfassungen nahezu gleich
+        sind (Cosinus-Ähnlichkeit >= duplicate_threshold).
+        
+        Args:
+            entries: Liste von (kunden_index, ep_index, customer_summary, ep_group_df) Tupeln
+            embeddings: Normierte Embeddings der Zusammenfassungen (None = nur Ähnlichkeitsgruppen)
+            
+        Returns:
+            Liste mit der Position des abgefragten Eintrags je Eintrag (eigene Position = wird abgefragt)
+        """
+        leaders = list(range(len(entries)))
+        if not entries:
+            return leaders
+        
+        # Ähnlichkeitsgruppen aus Schritt 1: Kunden_index -> Repräsentant
+        representative_of = {}
+        for representative, similar_indices in self.similar_groups.items():
+            representative_of[int(representative)] = int(representative)
+            for similar_index in similar_indices:
+                representative_of[similar_index] = int(representative)
+        
+        if self.duplicate_threshold is None:
+            embeddings = None
+        
+        positions_by_group = {}
+        for position, (_, ep_index, _, _) in enumerate(entries):
+            positions_by_group.setdefault(ep_index, []).append(position)
+        
+        for positions in positions_by_group.values():
+            group_leaders = []
+            leader_by_representative = {}
+            
+            for position in positions:
+                representative = representative_of.get(entries[position][0])
+                
+                # Gleiche Ähnlichkeitsgruppe aus Schritt 1 wurde bereits abgefragt
+                if representative in leader_by_representative:
+                    leaders[position] = leader_by_representative[representative]
+                    continue
+                
+                # Nahezu gleiche Zusammenfassung wurde bereits abgefragt
+                if embeddings is not None and group_leaders:
+                    scores = embeddings[group_leaders] @ embeddings[position]
+                    best = int(scores.argmax())
+                    if scores[best] >= self.duplicate_threshold:
+                        leaders[position] = group_leaders[best]
+                        if representative is not None:
+                            leader_by_representative[representative] = group_leaders[best]
+                        continue
+                
+                group_leaders.append(position)
+                if representative is not None:
+                    leader_by_representative[representative] = position
+        
+        return leaders
+    
+    def get_group_embeddings(self, ep_index, ep_group_df):
+        """
+        Liefert die Embeddings der Artikel-Vergleichstexte einer EP-Gruppe (einmal je Gruppe berechnet).
+        """
+        if ep_index not in self._group_embeddings:
+            self._group_embeddings[ep_index] = self.encode_texts(ep_group_df['comparison_text'].tolist())
+        return self._group_embeddings[ep_index]
+    
+    def select_candidate_articles(self, entries, embeddings):
+        """
+        Wählt je Eintrag die candidate_count ähnlichsten Artikel seiner EP-Gruppe per Embedding aus,
+        damit große EP-Gruppen nicht vollständig in den Prompt übernommen werden.
+        
+        Die Gruppe bleibt vollständig, wenn ihre Artikel keine Beschreibung haben oder der Schnitt
+        zwischen zwei fast gleich ähnliche Artikel (Abstand unter candidate_margin) fallen würde.
+        
+        Args:
+            entries: Liste von (kunden_index, ep_index, customer_summary, ep_group_df) Tupeln
+            embeddings: Normierte Embeddings der Zusammenfassungen
+            
+        Returns:
+            Liste mit den Positionen der Kandidaten in ep_group_df je Eintrag (None = alle Artikel)
+        """
+        candidate_positions = []
+        for (_, ep_index, _, ep_group_df), embedding in zip(entries, embeddings):
+            if len(ep_group_df) <= self.candidate_count or not ep_group_df['has_description'].all():
+                candidate_positions.append(None)
+                continue
+            
+            scores = self.get_group_embeddings(ep_index, ep_group_df) @ embedding
+            ranked_positions = np.argpartition(-scores, self.candidate_count)
+            top_positions = ranked_positions[:self.candidate_count]
+            
+            # Kein klarer Schnitt zwischen letztem Kandidaten und erstem weggelassenen Artikel
+            cutoff_gap = scores[top_positions].min() - scores[ranked_positions[self.candidate_count]]
+            if cutoff_gap < self.candidate_margin:
+                candidate_positions.append(None)
+                continue
+            
+            candidate_positions.append(np.sort(top_positions))
+        
+        return candidate_positions
+    
+    def rank_article_matches(self, entries, embeddings):
+        """
+        Wählt für jeden Eintrag den ähnlichsten Artikel seiner EP-Gruppe per Embedding aus.
+        
+        Der Artikel wird nur übernommen, wenn er mindestens ranking_min_score erreicht und sich
+        deutlich (mindestens ranking_margin) vom zweitbesten Artikel abhebt - sonst entscheidet
+        die OpenAI API. Gruppen mit Artikeln ohne Beschreibung werden nie per Embedding zugeordnet.
+        
+        Args:
+            entries: Liste von (kunden_index, ep_index, customer_summary, ep_group_df) Tupeln
+            embeddings: Normierte Embeddings der Zusammenfassungen
+            
+        Returns:
+            Liste mit (Artikelnummer, Cosinus-Ähnlichkeit) je Eintrag (None = OpenAI API fragen)
+        """
+        article_matches = []
+        for (_, ep_index, _, ep_group_df), embedding in zip(entries, embeddings):
+            # Bei nur einem Artikel gibt es keinen Abstand - OpenAI prüft, ob er passt.
+            # Vergleichstexte nur aus Artikelnummern sagen nichts über die Ähnlichkeit aus.
+            if len(ep_group_df) < 2 or not ep_group_df['has_description'].all():
+                article_matches.append(None)
+                continue
+            
+            scores = self.get_group_embeddings(ep_index, ep_group_df) @ embedding
+            second_best, best = np.partition(scores, -2)[-2:]
+            article_number = ep_group_df['Artikelnummer'].iloc[int(scores.argmax())]
+            
+            if (best >= self.ranking_min_score and best - second_best > self.ranking_margin
+                    and pd.notna(article_number)):
+                article_matches.append((str(article_number), float(best)))
+            else:
+                article_matches.append(None)
+        
+        return article_matches
+    
+    async def _match_batch(self, semaphore, rate_limiter, ep_index, customer_entries, ep_group_df):
+        """
+        Sucht die Artikelnummern für einen Batch von Einträgen (begrenzt durch semaphore).
+        
+        Returns:
+            Liste der Mapping-Ergebnisse (in der Reihenfolge von customer_entries)
+        """
+        async with semaphore:
+            article_matches = await self.find_best_article_matches(ep_index, customer_entries, ep_group_df, rate_limiter)
+        
+        results = []
+        for kunden_index, _ in customer_entries:
+            article_number = article_matches[kunden_index]
+            results.append({
+                'Kunden_index': kunden_index,
+                'EP_original_index': ep_index,
+                'article_number': article_number,
+                'similarity_score': np.nan,  # Entscheidung der OpenAI API, keine Ähnlichkeit
+                'mapping_status': 'Artikelnummer gefunden' if article_number is not None else 'Kein passender Artikel gefunden'
+            })
+        return results
+    
+    async def _match_entries(self, entries, candidate_positions=None):
+        """
+        Sucht die Artikelnummern aller Einträge parallel mit der OpenAI API.
+        
+        Einträge derselben EP-Gruppe werden in Batches von bis zu batch_size Einträgen
+        gemeinsam abgefragt, damit die Artikelliste nur einmal pro Batch gesendet wird.
+        
+        Args:
+            entries: Liste von (kunden_index, ep_index, customer_summary, ep_group_df) Tupeln
+            candidate_positions: Kandidaten je Eintrag aus select_candidate_articles (None = alle Artikel)
+            
+        Returns:
+            Liste der Mapping-Ergebnisse (in der Reihenfolge von entries)
+        """
+        positions_by_group = {}
+        for position, (_, ep_index, _, _) in enumerate(entries):
+            positions_by_group.setdefault(ep_index, []).append(position)
+        
+        batches = []
+        for ep_index, positions in positions_by_group.items():
+            ep_group_df = entries[positions[0]][3]
+            for start in range(0, len(positions), self.batch_size):
+                batch_positions = positions[start:start + self.batch_size]
+                customer_entries = [(entries[position][0], entries[position][2]) for position in batch_positions]
+                
+                # Prompt enthält nur die Kandidaten der Einträge dieses Batches
+                # (die ganze Gruppe, sobald ein Eintrag keine Vorauswahl hat)
+                batch_group_df = ep_group_df
+                if candidate_positions is not None and all(
+                    candidate_positions[position] is not None for position in batch_positions
+                ):
+                    batch_candidates = np.unique(np.concatenate(
+                        [candidate_positions[position] for position in batch_positions]
+                    ))
+                    batch_group_df = ep_group_df.iloc[batch_candidates]
+                
+                batches.append((batch_positions, ep_index, customer_entries, batch_group_df))
+        
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        rate_limiter = RateLimiter(self.requests_per_minute, self.tokens_per_minute)
+        tasks = [
+            self._match_batch(semaphore, rate_limiter, ep_index, customer_entries, ep_group_df)
+            for _, ep_index, customer_entries, ep_group_df in batches
+        ]
+        batch_results = await tqdm_asyncio.gather(*tasks, desc="Artikelnummer-Mapping")
+        
+        results = [None] * len(entries)
+        for (batch_positions, _, _, _), matches in zip(batches, batch_results):
+            for position, match in zip(batch_positions, matches):
+                results[position] = match
+        return results
+    
+    def save_response_cache(self):
+        """Speichert die bisherigen OpenAI Antworten für spätere Läufe."""
+        with open(self.response_cache_path, 'w', encoding='utf-8') as f:
+            json.dump(self.response_cache, f, ensure_ascii=False)
+        logger.info(f"OpenAI Antwort-Cache gespeichert: {len(self.response_cache)} Antworten")
     
     def map_article_numbers(self):
         """
@@ -243,16 +658,19 @@ Artikelnummer: """
         
         # Ergebnisse sammeln
         mapping_results = []
+        pending_positions = []  # Position des Eintrags in mapping_results
+        pending_entries = []
         
         # Gruppiere Einträge nach EP-Überschriften
-        grouped_by_heading = self.kundendatei_summary.groupby('EP_original_index')
+        # (Einträge ohne Überschrift bilden eine eigene Gruppe)
+        grouped_by_heading = self.kundendatei_summary.groupby('EP_original_index', sort=False, dropna=False)
         
         for ep_index, group in tqdm(grouped_by_heading, desc="Verarbeite EP-Gruppen"):
             if pd.isna(ep_index):
                 # Keine Überschrift gefunden - alle Einträge ohne Artikelnummer
-                for _, row in group.iterrows():
+                for kunden_index in group['Kunden_index']:
                     mapping_results.append({
-                        'Kunden_index': row['Kunden_index'],
+                        'Kunden_index': kunden_index,
                         'EP_original_index': None,
                         'article_number': None,
                         'similarity_score': 0.0,
@@ -265,9 +683,9 @@ Artikelnummer: """
             
             if len(ep_group_df) == 0:
                 # Keine Artikel in der Gruppe gefunden
-                for _, row in group.iterrows():
+                for kunden_index in group['Kunden_index']:
                     mapping_results.append({
-                        'Kunden_index': row['Kunden_index'],
+                        'Kunden_index': kunden_index,
                         'EP_original_index': ep_index,
                         'article_number': None,
                         'similarity_score': 0.0,
@@ -275,39 +693,91 @@ Artikelnummer: """
                     })
                 continue
             
-            # Verarbeite alle Einträge dieser Gruppe
-            for _, row in group.iterrows():
-                customer_summary = row['summary_text']
-                
-                # Finde besten Artikel-Match mit OpenAI
-                best_match, article_number = self.find_best_article_match(
-                    customer_summary, ep_group_df
-                )
-                
-                if best_match is not None:
+            # Artikelnummer -> Katalog-Index (erster Artikel je Nummer), einmal je EP-Gruppe
+            article_numbers = ep_group_df['Artikelnummer'].dropna().astype(str).drop_duplicates()
+            article_rows = dict(zip(article_numbers, article_numbers.index))
+            self._group_article_rows[ep_index] = article_rows
+            
+            # Bereinigte Artikelbezeichnungen (ohne leere Werte), einmal je EP-Gruppe statt je Kundeneintrag
+            article_names = {}
+            for column in ('Bezeichnung', 'Kurztext / Bezeichnung'):
+                if column in ep_group_df.columns:
+                    names = ep_group_df[column].astype('string').str.strip()
+                    article_names[column] = names[names.notna() & (names != '')]
+            
+            # Einträge dieser Gruppe für die OpenAI API vormerken (Platzhalter hält die Reihenfolge)
+            for kunden_index, customer_summary in group[['Kunden_index', 'summary_text']].itertuples(index=False, name=None):
+                # Eindeutige lexikalische Treffer brauchen keinen API Call
+                article_number = self.find_exact_article_match(customer_summary, ep_group_df, article_rows, article_names)
+                if article_number is not None:
                     mapping_results.append({
-                        'Kunden_index': row['Kunden_index'],
+                        'Kunden_index': kunden_index,
                         'EP_original_index': ep_index,
                         'article_number': article_number,
-                        'mapping_status': 'Artikelnummer gefunden'
-                    })
-                else:
-                    mapping_results.append({
-                        'Kunden_index': row['Kunden_index'],
-                        'EP_original_index': ep_index,
-                        'article_number': None,
-                        'mapping_status': 'Kein passender Artikel gefunden'
+                        'similarity_score': 1.0,
+                        'mapping_status': 'Artikelnummer exakt gefunden'
                     })
+                    continue
                 
-                # Rate limiting für OpenAI API
-                time.sleep(1.0)
+                pending_positions.append(len(mapping_results))
+                pending_entries.append((kunden_index, ep_index, customer_summary, ep_group_df))
+                mapping_results.append(None)
+        
+        if pending_entries:
+            # Embeddings der Zusammenfassungen (für Duplikate, Ranking und Kandidatenauswahl)
+            embeddings = None
+            if (self.duplicate_threshold is not None or self.ranking_margin is not None
+                    or self.candidate_count is not None):
+                embeddings = self.encode_texts([str(entry[2]) for entry in pending_entries])
+            
+            # Ähnliche Einträge derselben EP-Gruppe nur einmal abfragen
+            leaders = self.find_duplicate_entries(pending_entries, embeddings)
+            query_positions = [position for position, leader in enumerate(leaders) if position == leader]
+            logger.info(f"Abgefragte Einträge: {len(query_positions)} von {len(pending_entries)} "
+                        f"({len(pending_entries) - len(query_positions)} aus ähnlichen Einträgen übernommen)")
+            
+            # Eindeutig bester Artikel per Embedding braucht keinen API Call
+            match_by_position = {}
+            if self.ranking_margin is not None:
+                ranked = self.rank_article_matches(
+                    [pending_entries[position] for position in query_positions], embeddings[query_positions]
+                )
+                for position, ranked_match in zip(query_positions, ranked):
+                    if ranked_match is not None:
+                        article_number, similarity_score = ranked_match
+                        match_by_position[position] = {
+                            'Kunden_index': pending_entries[position][0],
+                            'EP_original_index': pending_entries[position][1],
+                            'article_number': article_number,
+                            'similarity_score': similarity_score,
+                            'mapping_status': 'Artikelnummer per Embedding gefunden'
+                        }
+                query_positions = [position for position in query_positions if position not in match_by_position]
+                logger.info(f"Per Embedding zugeordnet: {len(match_by_position)}, OpenAI API: {len(query_positions)}")
+            
+            # Nur die ähnlichsten Artikel je Eintrag in den Prompt übernehmen
+            query_entries = [pending_entries[position] for position in query_positions]
+            candidate_positions = None
+            if self.candidate_count is not None:
+                candidate_positions = self.select_candidate_articles(query_entries, embeddings[query_positions])
+            
+            # Alle Batches parallel abfragen (begrenzt durch max_concurrent_requests)
+            try:
+                matches = asyncio.run(self._match_entries(query_entries, candidate_positions))
+            finally:
+                # Bisherige Antworten auch bei einem Abbruch sichern
+                self.save_response_cache()
+            match_by_position.update(zip(query_positions, matches))
+            
+            for result_position, leader, entry in zip(pending_positions, leaders, pending_entries):
+                mapping_results[result_position] = {**match_by_position[leader], 'Kunden_index': entry[0]}
         
         # Erstelle DataFrame
         self.mapping_results_df = pd.DataFrame(mapping_results)
         
         # Speichere Ergebnisse
-        results_path = self.intermediate_dir / "article_number_mapping.xlsx"
-        self.mapping_results_df.to_excel(results_path, index=False)
+        results_path = self.intermediate_dir / "article_number_mapping.parquet"
+        self.mapping_results_df.to_parquet(results_path, compression='zstd')
         logger.info(f"Artikelnummer-Mapping-Ergebnisse gespeichert: {results_path}")
         
         # Statistiken
@@ -326,24 +796,24 @@ Artikelnummer: """
         # Füge Artikelnummern zur ursprünglichen Kundendatei hinzu
         final_kundendatei = self.kundendatei.copy()
         
-        # Erstelle Mapping-Dictionary
-        article_mapping = dict(zip(
-            self.mapping_results_df['Kunden_index'],
-            self.mapping_results_df['article_number']
-        ))
+        # Artikelnummer je Kunden_index (jeder Eintrag kommt genau einmal vor)
+        article_mapping = self.mapping_results_df.set_index('Kunden_index', verify_integrity=True)['article_number']
         
-        # Füge Artikelnummer-Spalte hinzu
+        # Füge Artikelnummer-Spalte hinzu (Hash-Join über den Index)
         final_kundendatei.insert(0, 'Artikelnummer', final_kundendatei.index.map(article_mapping))
         
-        # Speichere finale Kundendatei
+        # Speichere finale Kundendatei als Excel und CSV (unabhängig voneinander, daher parallel)
         final_path = Path("../cvs/kundendatei_final.xlsx")
-        final_kundendatei.to_excel(final_path, index=False)
-        logger.info(f"Finale Kundendatei gespeichert: {final_path}")
-        
-        # Erstelle auch CSV-Version
         final_csv_path = Path("../cvs/kundendatei_final.csv")
-        final_kundendatei.to_csv(final_csv_path, index=False, encoding='utf-8-sig')
-        logger.info(f"Finale Kundendatei (CSV) gespeichert: {final_csv_path}")
+        
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            excel_future = executor.submit(final_kundendatei.to_excel, final_path, index=False, engine='xlsxwriter')
+            csv_future = executor.submit(write_csv, final_kundendatei, final_csv_path)
+            
+            excel_future.result()
+            logger.info(f"Finale Kundendatei gespeichert: {final_path}")
+            csv_future.result()
+            logger.info(f"Finale Kundendatei (CSV) gespeichert: {final_csv_path}")
         
         return final_kundendatei
     
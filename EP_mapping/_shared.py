@@ -0,0 +1,146 @@
+"""
+Gemeinsame Hilfsfunktionen der EP-Mapping Pipeline.
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+
+logger = logging.getLogger(__name__)
+
+
+def load_table(file_path) -> pd.DataFrame:
+    """
+    Lädt eine Excel-Tabelle (erstes Sheet).
+
+    Die Excel-Datei wird nur beim ersten Lauf (oder nach einer Änderung) geparst und
+    danach als Parquet-Datei neben der Excel-Datei zwischengespeichert.
+
+    Args:
+        file_path: Pfad zur Excel-Datei
+
+    Returns:
+        DataFrame mit dem Inhalt der Tabelle
+    """
+    file_path = os.fspath(file_path)
+    cache_path = f"{os.path.splitext(file_path)[0]}.parquet"
+
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(file_path):
+        logger.info(f"Lade zwischengespeicherte Daten: {cache_path}")
+        return pd.read_parquet(cache_path, engine="pyarrow")
+
+    logger.info(f"Lade Daten aus: {file_path}")
+    data = pd.read_excel(file_path, engine="calamine")
+
+    # Cache ist optional - gemischte Spaltentypen kann Parquet z.B. nicht speichern
+    try:
+        data.to_parquet(cache_path, engine="pyarrow")
+    except (ValueError, TypeError) as e:
+        logger.warning(f"Konnte Daten nicht zwischenspeichern: {e}")
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+
+    return data
+
+
+def write_csv(data: pd.DataFrame, file_path) -> None:
+    """
+    Speichert einen DataFrame als CSV (UTF-8 mit BOM, damit Excel die Umlaute erkennt).
+
+    Geschrieben wird mit dem PyArrow CSV-Writer. Strings stehen dabei immer in Anführungszeichen,
+    der Inhalt ist beim Einlesen derselbe wie mit DataFrame.to_csv.
+
+    Args:
+        data: Zu speichernder DataFrame (ohne Index)
+        file_path: Pfad der CSV-Datei
+    """
+    # Gemischte Spaltentypen kann Arrow nicht abbilden - dann bleibt es beim pandas-Writer
+    try:
+        table = pa.Table.from_pandas(data, preserve_index=False)
+    except (ValueError, TypeError) as e:
+        logger.warning(f"CSV wird ohne PyArrow geschrieben: {e}")
+        data.to_csv(file_path, index=False, encoding="utf-8-sig")
+        return
+
+    with open(file_path, "wb") as f:
+        f.write("\ufeff".encode("utf-8"))
+        pa_csv.write_csv(table, f)
+
+
+def heading_mask(art: pd.Series) -> np.ndarray:
+    """
+    Markiert die Überschriftenzeilen des EP-Katalogs (Spalte "Art" beginnt mit "NG").
+
+    Der Vergleich läuft als PyArrow-Stringkernel über die ganze Spalte statt pro Zeile in Python.
+
+    Args:
+        art: Spalte "Art" des EP-Katalogs
+
+    Returns:
+        Boolesches NumPy-Array (fehlende Werte zählen nicht als Überschrift)
+    """
+    starts_with_ng = pc.starts_with(pa.array(art.astype('string')), pattern='NG')
+    return pc.fill_null(starts_with_ng, False).to_numpy(zero_copy_only=False)
+
+
+def estimate_tokens(text) -> int:
+    """
+    Schätzt die Anzahl Tokens eines Textes (ca. 4 Zeichen pro Token).
+    """
+    return len(text) // 4 + 1
+
+
+class RateLimiter:
+    """
+    Token-Bucket Begrenzung für OpenAI API Calls (Anfragen und Tokens pro Minute).
+
+    Beide Kontingente füllen sich kontinuierlich wieder auf; ein Call wartet, bis genug
+    Anfragen und Tokens verfügbar sind. Muss innerhalb der laufenden Event-Loop erstellt werden.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        """
+        Args:
+            requests_per_minute: Maximale Anfragen pro Minute (None = unbegrenzt)
+            tokens_per_minute: Maximale Tokens pro Minute (None = unbegrenzt)
+        """
+        self.capacities = [requests_per_minute, tokens_per_minute]
+        self.levels = [float(capacity or 0) for capacity in self.capacities]
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int):
+        """
+        Wartet, bis eine Anfrage mit `tokens` Tokens gesendet werden darf, und bucht sie ab.
+        """
+        # Größere Anfragen als das Kontingent würden sonst nie freigegeben
+        amounts = [1, min(tokens, self.capacities[1] or tokens)]
+
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                elapsed = now - self.updated
+                self.updated = now
+
+                wait = 0.0
+                for i, capacity in enumerate(self.capacities):
+                    if capacity is None:
+                        continue
+                    self.levels[i] = min(capacity, self.levels[i] + capacity * elapsed / 60)
+                    if self.levels[i] < amounts[i]:
+                        wait = max(wait, (amounts[i] - self.levels[i]) * 60 / capacity)
+
+                if wait == 0.0:
+                    for i, capacity in enumerate(self.capacities):
+                        if capacity is not None:
+                            self.levels[i] -= amounts[i]
+                    return
+
+                await asyncio.sleep(wait)
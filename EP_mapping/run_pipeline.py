@@ -12,7 +12,7 @@ Autor: AI Assistant
 Datum: 2025-08-03
 """
 
-import subprocess
+import importlib
 import sys
 import os
 import logging
@@ -22,44 +22,34 @@ from pathlib import Path
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def run_step(step_number: int, step_name: str, script_path: str):
+def run_step(step_number: int, step_name: str, module_name: str):
     """
-    Führt einen einzelnen Schritt der Pipeline aus.
+    Führt einen einzelnen Schritt der Pipeline im laufenden Interpreter aus.
+    
+    pandas, torch, sentence-transformers und openai werden so nur einmal importiert,
+    statt für jeden Schritt einen neuen Python-Prozess zu starten.
     
     Args:
         step_number: Nummer des Schritts
         step_name: Name des Schritts
-        script_path: Pfad zum Skript
+        module_name: Modulname des Skripts (z.B. "01_find_similar_entries")
     """
     logger.info(f"=== SCHRITT {step_number}: {step_name} ===")
     
-    if not os.path.exists(script_path):
-        logger.error(f"Skript nicht gefunden: {script_path}")
+    if not os.path.exists(f"{module_name}.py"):
+        logger.error(f"Skript nicht gefunden: {module_name}.py")
         return False
     
     try:
-        # Führe Skript aus
-        result = subprocess.run([sys.executable, script_path], 
-                              capture_output=True, text=True, check=True)
-        
-        # Zeige Ausgabe
-        if result.stdout:
-            print(result.stdout)
-        if result.stderr:
-            print(result.stderr)
+        # Importiere Skript und führe seine main() Funktion aus
+        module = importlib.import_module(module_name)
+        module.main()
         
         logger.info(f"✓ Schritt {step_number} erfolgreich abgeschlossen")
         return True
         
-    except subprocess.CalledProcessError as e:
-        logger.error(f"❌ Fehler in Schritt {step_number}: {e}")
-        if e.stdout:
-            print("STDOUT:", e.stdout)
-        if e.stderr:
-            print("STDERR:", e.stderr)
-        return False
     except Exception as e:
-        logger.error(f"❌ Unerwarteter Fehler in Schritt {step_number}: {e}")
+        logger.exception(f"❌ Fehler in Schritt {step_number}: {e}")
         return False
 
 def check_prerequisites():
@@ -73,9 +63,9 @@ def check_prerequisites():
     
     # Überprüfe Dateien
     required_files = [
-        "cvs/Kundendatei.xlsx",
-        "cvs/EP_Katalog_subheadings.xlsx",
-        "cvs/EP_Katalog.xlsx"
+        "../cvs/Kundendatei.xlsx",
+        "../cvs/EP_Katalog_subheadings.xlsx",
+        "../cvs/EP_Katalog.xlsx"
     ]
     
     for file_path in required_files:
@@ -92,9 +82,8 @@ def check_prerequisites():
     ]
     
     for script in required_scripts:
-        script_path = os.path.join(os.path.dirname(__file__), script)
-        if not os.path.exists(script_path):
-            logger.error(f"Erforderliches Skript nicht gefunden: {script_path}")
+        if not os.path.exists(script):
+            logger.error(f"Erforderliches Skript nicht gefunden: {script}")
             return False
     
     logger.info("✓ Alle Voraussetzungen erfüllt")
@@ -104,6 +93,9 @@ def main():
     """
     Hauptfunktion der Pipeline.
     """
+    # Alle Skripte erwarten das EP_mapping Verzeichnis als Arbeitsverzeichnis
+    os.chdir(Path(__file__).parent)
+    
     logger.info("🚀 Starte EP-Mapping Pipeline")
     
     # Überprüfe Voraussetzungen
@@ -113,22 +105,20 @@ def main():
     
     # Definiere Pipeline-Schritte
     steps = [
-        (1, "Finde ähnliche Einträge", "01_find_similar_entries.py"),
-        (2, "Mapped auf EP-Überschriften", "02_map_ep_headings.py"),
-        (3, "OpenAI API Mapping", "03_openai_mapping.py"),
-        (4, "Artikelnummer-Mapping", "04_article_number_mapping.py")
+        (1, "Finde ähnliche Einträge", "01_find_similar_entries"),
+        (2, "Mapped auf EP-Überschriften", "02_map_ep_headings"),
+        (3, "OpenAI API Mapping", "03_openai_mapping"),
+        (4, "Artikelnummer-Mapping", "04_article_number_mapping")
     ]
     
     # Führe Schritte aus
-    for step_number, step_name, script_name in steps:
-        script_path = os.path.join(os.path.dirname(__file__), script_name)
-        
-        success = run_step(step_number, step_name, script_path)
+    for step_number, step_name, module_name in steps:
+        success = run_step(step_number, step_name, module_name)
         
         if not success:
             logger.error(f"❌ Pipeline fehlgeschlagen in Schritt {step_number}")
             logger.info("💡 Tipp: Du kannst einzelne Schritte manuell ausführen:")
-            logger.info(f"   python {script_path}")
+            logger.info(f"   python {module_name}.py")
             return False
         
         logger.info(f"Schritt {step_number} abgeschlossen - fahre mit nächstem Schritt fort")